@@ -0,0 +1,183 @@
+// Clientside callbacks of index.py, the graph and the tables are rendered from the data shipped by update_page
+const MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"];
+
+// current wall clock time in New York (same as help_functions.time_eastern)
+function easternNow() {
+    return new Date(new Date().toLocaleString("en-US", {timeZone: "America/New_York"}));
+}
+
+function dayLabel(date) {
+    return `${MONTHS[date.getMonth()]}-${String(date.getDate()).padStart(2, "0")}`;
+}
+
+// integer calendar key (month or month * 100 + day) of label like Oct or Oct-17
+function calendarKey(label) {
+    const [month, day] = label.split("-");
+    const key = MONTHS.indexOf(month) + 1;
+    return day ? key * 100 + parseInt(day, 10) : key;
+}
+
+// numeric arrays of the figure JSON come base64 encoded as {dtype, bdata}
+const TYPED_ARRAYS = {
+    f8: Float64Array,
+    f4: Float32Array,
+    i4: Int32Array,
+    i2: Int16Array,
+    i1: Int8Array,
+    u4: Uint32Array,
+    u2: Uint16Array,
+    u1: Uint8Array,
+};
+
+function traceValues(values) {
+    if (!values || !values.bdata) {
+        return values || [];
+    }
+    const bytes = Uint8Array.from(atob(values.bdata), (c) => c.charCodeAt(0));
+    return new TYPED_ARRAYS[values.dtype](bytes.buffer);
+}
+
+// marker of today on the moving average, all the points of the graph are in the year 1900
+function todayMarker(figure) {
+    const ma = figure.data.find((trace) => trace.name === "MA");
+    if (!ma) {
+        return null;
+    }
+    const now = easternNow();
+    const x = `1900-${String(now.getMonth() + 1).padStart(2, "0")}-${String(now.getDate()).padStart(2, "0")}`;
+    const i = ma.x.indexOf(x);
+    const value = i >= 0 ? traceValues(ma.y)[i] : NaN;
+    // short windows dont have every calendar day
+    if (!Number.isFinite(value)) {
+        return null;
+    }
+    return {
+        type: "scatter",
+        x: [x],
+        y: [value],
+        mode: "markers+text",
+        name: "best",
+        marker: {color: "blue", size: 15, symbol: "x"},
+        showlegend: false,
+        text: `${(value * 100).toFixed(1)}%`,
+        textposition: "top left",
+        textfont: {size: 18},
+    };
+}
+
+function options(labels) {
+    return labels.map((label) => ({label: label, value: label}));
+}
+
+// table shipped as {columns, keys, data} to DataTable records of the given columns
+function records(table, columns, keep) {
+    const indices = columns.map((column) => table.columns.indexOf(column));
+    const res = [];
+    table.keys.forEach((key, i) => {
+        if (!keep || keep(key)) {
+            const row = {};
+            columns.forEach((column, j) => (row[column] = table.data[i][indices[j]]));
+            res.push(row);
+        }
+    });
+    return res;
+}
+
+function tableColumns(columns) {
+    return columns.map((column) => ({name: column, id: column}));
+}
+
+// rows of the month / day in all the precomputed windows
+function firstTable(first, table, label) {
+    const key = calendarKey(label);
+    const res = [];
+    first.windows.forEach((years) => {
+        const shipped = first[table][years];
+        const i = shipped.keys.indexOf(key);
+        if (i >= 0) {
+            const row = {Period: `${years} years`};
+            shipped.columns.forEach((column, j) => (row[column] = shipped.data[i][j]));
+            res.push(row);
+        }
+    });
+    return [res, tableColumns(res.length ? Object.keys(res[0]) : [])];
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    seasonality: {
+        figure: function (figureJson) {
+            if (!figureJson) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+            // the graph is built once per refresh, today is marked when it is shown
+            const figure = JSON.parse(figureJson);
+            const marker = todayMarker(figure);
+            if (marker) {
+                figure.data.push(marker);
+            }
+            return figure;
+        },
+
+        // lookbacks up to the longest one the history of the symbol covers, the picked one is clamped
+        lookbacks: function (firstData, years) {
+            if (!firstData) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+            const maxYears = firstData.max_years;
+            const options = [];
+            for (let y = 1; y <= maxYears; y++) {
+                options.push({label: `${y} year${y > 1 ? "s" : ""}`, value: y});
+            }
+            // an unchanged value would trigger update_page again
+            const value = years && years <= maxYears ? window.dash_clientside.no_update : maxYears;
+            return [options, value];
+        },
+
+        date_options: function (thisNextMonth, thisNextDay, pickMonth) {
+            const now = easternNow();
+            const tomorrow = new Date(now);
+            tomorrow.setDate(now.getDate() + 1);
+
+            const months = [MONTHS[now.getMonth()], MONTHS[(now.getMonth() + 1) % 12]];
+            const days = [dayLabel(now), dayLabel(tomorrow)];
+            if (!thisNextMonth) {
+                thisNextMonth = months[0];
+                thisNextDay = days[0];
+                pickMonth = months[0];
+            }
+            return [options(months), options(days), thisNextMonth, thisNextDay, pickMonth];
+        },
+
+        tables: function (windowData, firstData, thisNextMonth, thisNextDay, pickMonth, distribution) {
+            if (!windowData || !firstData || !thisNextMonth || !thisNextDay || !pickMonth) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+            const now = easternNow();
+            const show = (table) =>
+                table.columns.filter(
+                    (column) => distribution.length || !firstData.distribution_columns.includes(column)
+                );
+            const highlight = (query) => [{if: {filter_query: query}, backgroundColor: "lightblue"}];
+
+            const monthly = windowData.monthly;
+            const monthlyColumns = show(monthly);
+
+            const daily = windowData.daily;
+            const dailyColumns = show(daily);
+            const month = calendarKey(pickMonth);
+            const dailyData = records(daily, dailyColumns, (key) => Math.floor(key / 100) === month);
+
+            return [
+                ...firstTable(firstData, "monthly", thisNextMonth),
+                ...firstTable(firstData, "daily", thisNextDay),
+                records(monthly, monthlyColumns),
+                tableColumns(monthlyColumns),
+                highlight(`{Month}="${MONTHS[now.getMonth()]}"`),
+                dailyData,
+                tableColumns(dailyColumns),
+                highlight(`{Day}="${dayLabel(now)}"`),
+                pickMonth === MONTHS[now.getMonth()] ? Math.floor((now.getDate() + 1) / 12) : 0,
+            ];
+        },
+    },
+});
@@ -0,0 +1,235 @@
+"""
+Benchmark of the generate_graph pipeline and the index.py callbacks on deterministic synthetic histories,
+no network needed. Results are written as JSON and can be compared with a previous run:
+
+    python benchmark.py --years 10 50 100 --output bench.json
+    python benchmark.py --compare bench.json --threshold 1.2
+"""
+
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import tracemalloc
+from contextlib import redirect_stdout
+
+import numpy as np
+import pandas as pd
+
+import generate_graph
+from help_functions import *
+from providers import SyntheticProvider
+
+# synthetic history long enough for 100+ years windows
+ORIGIN = "1890-01-02"
+
+
+def measure(func, repeat):
+    """Times func repeat times and measures traced peak memory in one extra run"""
+    times = []
+    for _ in range(repeat):
+        st = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - st)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "seconds": min(times),
+        "median": statistics.median(times),
+        "peak_mb": round(peak / 2**20, 3),
+    }
+
+
+def bench_pipeline(years, provider, repeat):
+    """Times every stage of the single window pipeline"""
+    # warm up the generated series, the load stage measures slicing and preparing the frame only
+    generate_graph.SpxData(years, provider=provider)
+    sp = generate_graph.SpxData(years, provider=provider)
+    sp.prepare_calendar()
+
+    def get_data():
+        return sp.get_monthly_stats(), sp.get_daily_stats()
+
+    stages = {
+        "load": lambda: generate_graph.SpxData(years, provider=provider),
+        "prepare_calendar": sp.prepare_calendar,
+        "prepare_graph": sp.prepare_graph,
+        "plot_seasonality": sp.plot_seasonality,
+        "prepare_averages": sp.prepare_averages,
+        "get_data": get_data,
+    }
+    res = {stage: measure(func, repeat) for stage, func in stages.items()}
+
+    monthly_data, daily_data = get_data()
+    res["prettify_tables"] = measure(
+        lambda: sp.get_data(monthly_data, daily_data), repeat
+    )
+    res["rows"] = len(sp.df)
+    return res
+
+
+def bench_windows(windows, provider, repeat):
+    """Times the full multi window refresh, the incremental update and building of the results"""
+    engine = generate_graph.SpxWindows(windows, provider)
+    return {
+        "full_refresh": measure(
+            lambda: generate_graph.SpxWindows(windows, provider).get_results(),
+            repeat,
+        ),
+        "incremental_update": measure(engine.update, repeat),
+        "get_results": measure(engine.get_results, repeat),
+    }
+
+
+def callback_request(callback_key, callback, values, state=(), changed=0):
+    """
+    Payload of the Dash callback request
+
+    :param changed: index of the input that triggered the callback
+    """
+    outputs = [
+        dict(zip(("id", "property"), output.rsplit(".", 1)))
+        for output in callback_key.strip(".").split("...")
+    ]
+    inputs = [{**inp, "value": value} for inp, value in zip(callback["inputs"], values)]
+    state = [{**st, "value": value} for st, value in zip(callback["state"], state)]
+    return {
+        "output": callback_key,
+        "outputs": outputs,
+        "inputs": inputs,
+        "changedPropIds": [f"{inputs[changed]['id']}.{inputs[changed]['property']}"],
+        "state": state,
+    }
+
+
+def bench_callbacks(windows, provider, repeat):
+    """Times the server callback through the Flask test client, the rest runs in the browser"""
+    import index
+
+    engine = generate_graph.SpxWindows(windows, provider)
+    index.publish(engine.symbol, *engine.get_results(), engine.aggregates)
+    index.page = index.Webpage()
+    client = index.server.test_client()
+
+    key = next(key for key in index.app.callback_map if "window_data" in key)
+    callback = index.app.callback_map[key]
+    values = [windows[-1], engine.symbol, 30]
+    snap = index.snapshot
+    first_version = [snap.version, snap.created, engine.symbol]
+    callbacks = {
+        # first load of the page ships everything
+        "update_page": callback_request(key, callback, values, [None]),
+        # first tables data already in the browser
+        "update_page_lookback": callback_request(
+            key, callback, values, [first_version]
+        ),
+        "update_page_holding": callback_request(
+            key, callback, values, [first_version], 2
+        ),
+    }
+
+    def post(payload):
+        resp = client.post("/_dash-update-component", json=payload)
+        assert resp.status_code == 200, resp.status_code
+
+    res = {}
+    for name, payload in callbacks.items():
+        res[name] = measure(lambda: post(payload), repeat)
+    # callbacks without the response cache
+    for name in list(callbacks):
+        res[f"{name}_uncached"] = measure(
+            lambda: (index.response_cache.invalidate(), post(callbacks[name])),
+            repeat,
+        )
+    return res
+
+
+def compare(results, baseline, threshold):
+    """Prints time ratios against the baseline, returns names of stages slower than the threshold"""
+    regressions = []
+
+    def walk(new, old, path):
+        if isinstance(new, dict) and "seconds" in new:
+            if isinstance(old, dict) and old.get("seconds"):
+                ratio = new["seconds"] / old["seconds"]
+                flag = " REGRESSION" if ratio > threshold else ""
+                print(
+                    f"{path:<50} {old['seconds']:.5f}s -> {new['seconds']:.5f}s  x{ratio:.2f}{flag}"
+                )
+                if flag:
+                    regressions.append(path)
+        elif isinstance(new, dict):
+            for key in new:
+                walk(
+                    new[key],
+                    old.get(key) if isinstance(old, dict) else None,
+                    f"{path}/{key}",
+                )
+
+    walk(results["results"], baseline["results"], "")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--years", type=int, nargs="+", default=[10, 20, 50, 100])
+    parser.add_argument("--windows", type=int, nargs="+", default=[10, 20, 30, 40, 50])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    parser.add_argument("--threshold", type=float, default=1.2)
+    parser.add_argument("--no-callbacks", action="store_true")
+    args = parser.parse_args()
+
+    provider = SyntheticProvider(seed=args.seed, origin=ORIGIN)
+    results = {
+        "meta": {
+            "time": get_time_in_sk(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "results": {"pipeline": {}},
+    }
+    # stdout is kept for the JSON results only
+    with redirect_stdout(sys.stderr):
+        for years in args.years:
+            debug_msg(f"Benchmarking pipeline of {years} years")
+            results["results"]["pipeline"][str(years)] = bench_pipeline(
+                years, provider, args.repeat
+            )
+
+        debug_msg(f"Benchmarking windows {args.windows}")
+        results["results"]["windows"] = bench_windows(
+            args.windows, provider, args.repeat
+        )
+        if not args.no_callbacks:
+            debug_msg("Benchmarking callbacks")
+            results["results"]["callbacks"] = bench_callbacks(
+                args.windows, provider, args.repeat
+            )
+
+    content = json.dumps(results, indent=2)
+    if args.output:
+        file_write(args.output, content)
+    else:
+        print(content)
+
+    if args.compare:
+        regressions = compare(results, open_json(args.compare), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} stages slower than x{args.threshold}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import re
+import gzip
+import hashlib
+from flask import request
+from dash.fingerprint import check_fingerprint
+from response_cache import ResponseCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# text responses worth compressing, images and fonts are compressed already
+COMPRESSIBLE = {
+    "application/json",
+    "application/javascript",
+    "text/javascript",
+    "text/css",
+    "text/html",
+    "text/plain",
+    "image/svg+xml",
+}
+# a year, the longest max-age the browsers keep
+IMMUTABLE_MAX_AGE = 31536000
+
+
+def is_versioned(req):
+    """
+    Fingerprinted Dash bundles and the assets linked with their modification time (?m=) change their
+    url with every change, so they never have to be revalidated
+    """
+    if req.path.startswith("/_dash-component-suites/"):
+        return check_fingerprint(req.path)[1]
+    return req.path.startswith("/assets/") and "m" in req.args
+
+
+class ResponseCompression:
+    """
+    Compresses the responses of the server with brotli (when the brotli package is installed) or gzip
+    as negotiated by the Accept-Encoding of the request. Compressed bodies are kept by their content
+    hash, so the assets and the responses of the current data version are compressed only once
+    """
+
+    def __init__(self, server, min_size=500, cache_size=256, level=6):
+        """
+        :param server: Flask server
+        :param min_size: smaller bodies are sent as they are
+        :param cache_size: number of compressed bodies kept
+        :param level: gzip level (1-9), brotli quality is derived from it
+        """
+        self.min_size = min_size
+        self.level = level
+        self.encodings = ["br", "gzip"] if brotli is not None else ["gzip"]
+        self.cache = ResponseCache(cache_size)
+        server.after_request(self.after_request)
+
+    def compress(self, body, encoding):
+        if encoding == "br":
+            return brotli.compress(body, quality=min(self.level - 1, 11))
+        # no timestamp in the header, same body always gives the same bytes
+        return gzip.compress(body, compresslevel=self.level, mtime=0)
+
+    def compressed(self, body, encoding):
+        """Compressed body, compressed only the first time the content is sent"""
+        key = (hashlib.sha1(body).digest(), encoding)
+        res = self.cache.get(key)
+        if res is None:
+            res = self.compress(body, encoding)
+            self.cache.put(key, res, self.cache.version)
+        return res
+
+    def precompress(self, server, path="/"):
+        """Compresses the page and the scripts and styles it links ahead of the first visitors"""
+        client = server.test_client()
+        page = client.get(path).get_data(as_text=True)
+        links = re.findall(r'(?:src|href)="(/[^"]+)"', page)
+        for url in [path, "/_dash-layout", "/_dash-dependencies", *links]:
+            for encoding in self.encodings:
+                client.get(url, headers={"Accept-Encoding": encoding})
+
+    def after_request(self, response):
+        if is_versioned(request) and response.status_code == 200:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+
+        if (
+            response.status_code != 200
+            or response.mimetype not in COMPRESSIBLE
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+
+        # files are streamed by default, the assets are small enough to be read whole
+        response.direct_passthrough = False
+        body = response.get_data()
+        if len(body) < self.min_size:
+            return response
+
+        response.set_data(self.compressed(body, encoding))
+        response.headers["Content-Encoding"] = encoding
+        # same resource in another encoding, weak ETags still match conditional requests
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -1,51 +1,303 @@
+import numpy as np
 import pandas as pd
-import yfinance as yf
 import plotly.graph_objects as go
-from calendar import monthrange
+import plotly.io as pio
+from calendar import monthrange, month_abbr
 from help_functions import *
+from price_store import PriceStore
+from metrics import registry, stage_time, download_failures, backup_fallbacks
+from providers import YFinanceProvider
+from market_calendar import last_completed_session
+
+# display names of the known symbols, other symbols are shown by their ticker
+symbol_names = {
+    "^GSPC": "SPX",
+    "^NDX": "NDX",
+    "^RUT": "RUT",
+    "^DJI": "DJI",
+}
+
+
+def symbol_name(symbol):
+    return symbol_names.get(symbol, symbol)
+
+
+# optional columns of the monthly and daily tables
+distribution_columns = [
+    "Median",
+    "Lower quartile",
+    "Upper quartile",
+    "Std deviation",
+    "Min % gain",
+    "Downside deviation",
+]
+
+
+def get_window_range(years, nw=None):
+    """
+    Returns start and end (exclusive) datetime of the lookback window ending with the last completed session
+
+    :param nw: end (exclusive) of the window instead of the last completed session
+    """
+    if nw is None:
+        nw = last_completed_session() + datetime.timedelta(days=1)
+        nw = datetime.datetime(year=nw.year, month=nw.month, day=nw.day)
+    # Feb 29 ends up on Feb 28 of a common year
+    past = nw - relativedelta(years=years)
+    return past, nw
+
+
+def segment_distribution(keys, values, dates):
+    """
+    Median, quartiles, std, min with its date and downside deviation (root mean square of the losses)
+    of every group from one sort by (group key, value), order statistics are picked by the segment
+    offsets. NaN values are skipped, groups without any value are missing in the result
+
+    :param keys: group key of every value
+    :param values: values of the groups, ties of the min are resolved by the order of the values
+    :param dates: date of every value
+    """
+    valid = ~np.isnan(values)
+    keys, values, dates = keys[valid], values[valid], dates[valid]
+    if not len(keys):
+        return pd.DataFrame(
+            columns=["median", "q1", "q3", "std", "min", "min_date", "downside"]
+        )
+
+    order = np.lexsort((values, keys))
+    keys, values, dates = keys[order], values[order], dates[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    sizes = np.diff(np.r_[starts, len(keys)])
+
+    def quantile(q):
+        # linear interpolation between the closest ranks, same as numpy
+        position = starts + q * (sizes - 1)
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        return values[low] + (values[high] - values[low]) * (position - low)
+
+    means = np.add.reduceat(values, starts) / sizes
+    squares = np.add.reduceat((values - np.repeat(means, sizes)) ** 2, starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        std = np.where(sizes > 1, np.sqrt(squares / (sizes - 1)), np.nan)
+    losses = np.add.reduceat(np.minimum(values, 0) ** 2, starts)
+
+    return pd.DataFrame(
+        {
+            "median": quantile(0.5),
+            "q1": quantile(0.25),
+            "q3": quantile(0.75),
+            "std": std,
+            "min": values[starts],
+            "min_date": pd.DatetimeIndex(dates[starts]),
+            "downside": np.sqrt(losses / sizes),
+        },
+        index=keys[starts],
+    )
+
+
+def compact_table(df):
+    """
+    Numeric monthly or daily statistics as they are kept in the results, values in float32 and the dates
+    as their years in int16, see prettify_table
+
+    :param df: statistics of process_group_data or SpxAggregates.group_stats
+    """
+    res = pd.DataFrame(index=df.index.astype(np.int16))
+    for column in df:
+        if column.endswith("_date"):
+            # only the year of the max / min is shown
+            years = df[column].dt.year.fillna(0).to_numpy()
+            res[f"{column[:-5]}_year"] = years.astype(np.int16)
+        else:
+            res[column] = df[column].to_numpy(dtype=np.float32)
+    return res
+
+
+def prettify_table(df, index_name):
+    """
+    Formats the compact table for display, labels the calendar keys and writes the gains as percents
+
+    :param df: table of compact_table
+    :param index_name: Month or Day
+    """
+    df = df.drop(229, axis=0, errors="ignore")
+    # tables stay indexed by the calendar key, label is made only once here
+    df.index.names = ["key"]
+    res = pd.DataFrame(
+        {index_name: [calendar_label(key) for key in df.index]}, index=df.index
+    )
+
+    percent = lambda column: (df[column].astype(float) * 100).round(2).astype(str) + "%"
+    for column in df:
+        if column == "freq":
+            res[column] = df[column].astype(float).round(1).astype(str) + "%"
+        elif f"{column}_year" in df:
+            # value with the year it happened
+            res[column] = (
+                percent(column) + " (" + df[f"{column}_year"].astype(str) + ")"
+            )
+        elif not column.endswith("_year"):
+            res[column] = percent(column)
+    if index_name == "Day":
+        index_name = "Dai"
+    return res.rename(
+        columns={
+            "avg": f"Average {index_name}ly % gain",
+            "max": f"Max {index_name}ly % gain",
+            "freq": f"{index_name}ly gain frequency",
+            **dict(
+                zip(
+                    ["median", "q1", "q3", "std", "min", "downside"],
+                    distribution_columns,
+                )
+            ),
+        }
+    )
+
+
+def calendar_label(key):
+    """Converts integer calendar key (month or month * 100 + day) to label like Oct or Oct-17"""
+    if key > 100:
+        return f"{month_abbr[key // 100]}-{key % 100:02d}"
+    return month_abbr[key]
+
+
+def calendar_key(label):
+    """Converts label like Oct or Oct-17 back to integer calendar key"""
+    month, _, day = label.partition("-")
+    key = list(month_abbr).index(month)
+    if day:
+        key = key * 100 + int(day)
+    return key
+
+
+def decimate(y, points):
+    """
+    Indices of the points kept when the line is reduced to the given number of points by the largest
+    triangle three buckets method, the shape (peaks and drops) of the line is preserved
+
+    :param y: values of the line at equally spaced x
+    """
+    n = len(y)
+    if points >= n or points < 3:
+        return np.arange(n)
+
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    # first and last points are kept, the rest is split to points - 2 buckets
+    edges = (np.arange(points - 1) * (n - 2) / (points - 2)).astype(int) + 1
+    edges[-1] = n - 1
+    keep = [0]
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        # average point of the next bucket (the last point for the last bucket)
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_x = (end + next_end - 1) / 2
+        next_y = y[end:next_end].mean()
+
+        a = keep[-1]
+        x = np.arange(start, end)
+        area = np.abs((a - next_x) * (y[start:end] - y[a]) - (a - x) * (next_y - y[a]))
+        keep.append(start + int(area.argmax()))
+    keep.append(n - 1)
+    return np.array(keep)
+
+
+def figure_json(fig, points=None):
+    """
+    Compact JSON of the seasonality graph, it is serialized once when the data are refreshed and
+    served as is
+
+    :param points: number of points the raw trace is reduced to, all points by default
+    """
+    content = fig.to_plotly_json()
+    for trace in content["data"]:
+        # all points are in the year 1900, time of the day is not needed
+        trace["x"] = pd.DatetimeIndex(trace["x"]).strftime("%Y-%m-%d").to_numpy()
+    if points:
+        y = np.asarray(fig.data[0].y, dtype=float)
+        keep = decimate(y, points)
+        raw = content["data"][0]
+        raw["x"], raw["y"] = raw["x"][keep], y[keep]
+    return pio.to_json(content, validate=False)
 
 
 class SpxData:
     symbol = "^GSPC"
+    provider = YFinanceProvider()
 
-    def __init__(self, years):
+    def __init__(self, years, df=None, provider=None, symbol=None):
+        """
+        :param years: lookback of the data in years
+        :param df: already loaded (and prepared) prices, skips downloading when given
+        :param provider: market data provider (providers.py), yfinance by default
+        :param symbol: yahoo symbol of the instrument, SPX by default
+        """
         self.years = years
-        nw = datetime.datetime.now() - datetime.timedelta(days=1)
-        nw = datetime.datetime(year=nw.year, month=nw.month, day=nw.day)
-        past = datetime.datetime(year=nw.year - self.years, month=nw.month, day=nw.day)
-        self.df = self.download_spx(past, nw)
+        if provider is not None:
+            self.provider = provider
+        if symbol is not None:
+            self.symbol = symbol
+        self.name = symbol_name(self.symbol)
+        self.store = PriceStore(f"logs/{self.symbol}.prices")
+        # local closes index, it starts with a margin before the window to resolve boundary closes
+        self.closes = None
+        self.closes_start = None
+        if df is None:
+            past, nw = get_window_range(self.years)
+            prices = self.download_spx(self.margin_start(past), nw)
+            self.set_closes(prices["Adj Close"], self.margin_start(past))
+            # only the closes are used, the whole bars stay in the price store
+            df = prices.loc[prices.index >= past, ["Adj Close"]].copy()
+        self.df = df
+
+    @staticmethod
+    def margin_start(past):
+        """Start of the download, includes close of the previous year and month of the window start"""
+        return datetime.datetime(year=past.year - 1, month=12, day=27)
 
+    def set_closes(self, closes, start):
+        self.closes = closes
+        self.closes_start = start
+
+    @stage_time.time(stage="download")
     def download_spx(self, start, end):
         try:
-            res = yf.download(
-                self.symbol,
-                start=start,
-                end=end,
-                progress=False,
-            )
+            res = self.provider.get_prices(self.symbol, start, end)
             res.index[0].year  # check if downloading data was successful
 
-            if (end - start).days >= 49 * 365:
-                self.store_prices(res, start)
+            if self.provider.live and (end - start).days >= 49 * 365:
+                self.store_prices(res)
         except Exception:
             traceback.print_exc()
+            download_failures.inc(provider=self.provider.name)
             debug_msg("Downloading data failed, loading backup...")
             res = self.load_backup(start, end)
 
         return res
 
-    def store_prices(self, df, start):
-        # store also first day of the year
-        res = self.get_last_close(start.year, raw=True)
-        df = pd.concat([res, df])
-        df.to_csv(f"logs/{self.symbol}")
+    def store_prices(self, df):
+        # the download already contains the margin with the last days of the previous year
+        self.store.write(df)
+
+    def append_prices(self, df):
+        """Appends newly downloaded bars to the backup"""
+        if self.store.read_meta():
+            self.store.append(df)
 
     def load_backup(self, start, end):
+        res = self.store.read(start, end)
+        if res is not None:
+            backup_fallbacks.inc(source="store")
+            return res
+
+        # legacy CSV backup
         res = pd.read_csv(f"logs/{self.symbol}")
         res["Date"] = pd.to_datetime(res["Date"], format="%Y-%m-%d", errors="coerce")
         res = res.set_index("Date", drop=True)
 
         res = res[(res.index >= start) & (res.index <= end)]
+        backup_fallbacks.inc(source="csv")
         return res
 
     @staticmethod
@@ -54,15 +306,20 @@ class SpxData:
         return (inc - original) / original
 
     @staticmethod
-    def calc_freq(incs):
-        pos = 0
-        for inc in incs.values:
-            if inc > 0:
-                pos += 1
+    def period_open(close, keys, first_close):
+        """
+        For every row returns the close of the last row before its period (year, month) started
 
-        return pos / len(incs.values) * 100
+        :param close: array of closing prices sorted by date
+        :param keys: integer period key of every row (e.g. year), same length as close
+        :param first_close: close before the first period in the data
+        """
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        prev_close = np.r_[first_close, close[:-1]]
+        return np.repeat(prev_close[starts], np.diff(np.r_[starts, len(keys)]))
 
-    def get_last_close(self, yr, month=0, raw=False):
+    def get_last_close(self, yr, month=0):
+        """Close before the given year (or month) started, downloaded only if missing in the local index"""
         if month:
             if month == 1:
                 yr -= 1
@@ -71,51 +328,88 @@ class SpxData:
             start_str = datetime.datetime(year=yr, month=month - 1, day=day - 3)
             if month == 13:
                 yr += 1
-                month = 12
+                month = 1
             end_str = datetime.datetime(year=yr, month=month, day=1)
 
         else:
             start_str = datetime.datetime(year=yr - 1, month=12, day=27)
             end_str = datetime.datetime(year=yr, month=1, day=1)
 
-        sp = self.download_spx(start_str, end_str)
-        if raw:
-            return sp
+        if self.closes is not None and self.closes_start <= start_str:
+            closes = self.closes[
+                (self.closes.index >= start_str) & (self.closes.index < end_str)
+            ]
+        else:
+            closes = self.download_spx(start_str, end_str)["Adj Close"]
 
         try:
-            return sp.iloc[-1]["Adj Close"]
+            return closes.iloc[-1]
         except IndexError:
             return 0
 
-    def prepare_graph(self):
+    def set_column(self, column, rows, values):
+        """Writes values to the column from the given row on (whole column for row 0)"""
+        if rows:
+            self.df.iloc[rows:, self.df.columns.get_loc(column)] = values
+        else:
+            self.df[column] = values
+
+    @stage_time.time(stage="prepare_calendar")
+    def prepare_calendar(self, rows=0):
+        """Integer calendar key of every row (month * 100 + day), used for grouping instead of strings"""
+        index = self.df.index[rows:]
+        month_day = index.month.to_numpy() * 100 + index.day.to_numpy()
+        self.set_column("month_day", rows, month_day.astype(np.int16))
 
-        yearly_returns = {}
-        last_close = self.get_last_close(self.df.index[0].year)
+    @stage_time.time(stage="prepare_graph")
+    def prepare_graph(self, rows=0):
+        """
+        Calculate % gain of every day since the close of the previous year
 
-        for ind, row in self.df.iterrows():
-            # get closing value of last year
-            if ind.year not in yearly_returns:
-                yearly_returns[ind.year] = {"original": last_close}
-            last_close = row["Adj Close"]
+        :param rows: recalculate only from this row on, it has to be the first row of a year
+        """
+        close = self.df["Adj Close"].to_numpy(dtype=float)
+        if rows:
+            last_close = close[rows - 1]
+        else:
+            last_close = self.get_last_close(self.df.index[0].year)
+        # history starts within the year (symbol younger than the window), its first close is the base
+        if not last_close:
+            last_close = close[0]
 
-        self.df["increase"] = self.df.apply(
-            lambda row: self.perc_increase(
-                yearly_returns[row.name.year]["original"], row["Adj Close"]
-            ),
-            axis=1,
+        years = self.df.index.year.to_numpy()
+        original = self.period_open(close[rows:], years[rows:], last_close)
+        # gains are shown to 0.01 %, float32 keeps 7 significant digits of them
+        self.set_column(
+            "increase",
+            rows,
+            self.perc_increase(original, close[rows:]).astype(np.float32),
         )
 
-    def plot_seasonality(self):
+    @stage_time.time(stage="seasonality")
+    def get_seasonality(self, df=None):
+        """Average % gain since the start of the year of every calendar day"""
+        df = self.df if df is None else df
+        return df.groupby("month_day")["increase"].mean()
+
+    @stage_time.time(stage="plot")
+    def plot_seasonality(self, df_graph=None):
 
-        df_graph = self.df.groupby(self.df.index.strftime("%m-%d"))["increase"].mean()
-        df_graph["01-01"] = 0
+        if df_graph is None:
+            df_graph = self.get_seasonality()
+        df_graph = df_graph.copy()
+        df_graph[101] = 0
         df_graph = df_graph.sort_index()
 
-        df_graph.index = pd.to_datetime(df_graph.index, format="%m-%d", errors="coerce")
+        keys = df_graph.index.to_numpy()
+        df_graph.index = pd.DatetimeIndex(
+            pd.to_datetime(
+                pd.DataFrame({"year": 1900, "month": keys // 100, "day": keys % 100}),
+                errors="coerce",
+            )
+        )
         df_ma = df_graph.rolling(window=7).mean()
 
-        cur_day = int(time_eastern()[1])
-        cur_month = time_eastern()[5]
         fig = go.Figure()
         fig.add_trace(
             go.Scatter(
@@ -126,6 +420,7 @@ class SpxData:
                 line={"color": "firebrick", "width": 1, "dash": "dash"},
             )
         )
+        # today is marked in the browser (assets/seasonality.js), the graph is built once per refresh
         fig.add_trace(
             go.Scatter(
                 x=df_ma.index,
@@ -135,147 +430,669 @@ class SpxData:
                 line={"color": "blue", "width": 2},
             )
         )
-        val = df_ma[
-            (df_ma.index.month == cur_month) & (df_ma.index.day == cur_day)
-        ].values
-        fig.add_trace(
-            go.Scatter(
-                x=[datetime.datetime(year=1900, month=cur_month, day=cur_day)],
-                y=df_ma[
-                    (df_ma.index.month == cur_month) & (df_ma.index.day == cur_day)
-                ].values,
-                mode="markers + text",
-                name="best",
-                marker=dict(color="blue", size=15, symbol="x"),
-                showlegend=False,
-                text=str(round(val[0] * 100, 1)) + "%",
-                textposition="top left",
-                textfont={"size": 18},
-            )
-        )
         fig.update_layout(
             xaxis=dict(tickformat="%d-%B", nticks=12, gridcolor="LightPink")
         )
         fig.update_layout(yaxis=dict(tickformat=".1%"))
         fig.update_layout(
-            title=f"Showing SPX cumulative performance over the last <b>{self.years} years</b>",
+            title=f"Showing {self.name} cumulative performance over the last <b>{self.years} years</b>",
             title_x=0.5,
         )
 
         return fig
 
-    def prepare_averages(self):
+    @stage_time.time(stage="prepare_averages")
+    def prepare_averages(self, rows=0):
         """
         Calculate monthly percentage gains (close price of previous month and current month) and the end of current month
+
+        :param rows: recalculate only from this row on, it has to be the first row of a month
         """
-        monthly_returns = {}
-        last_close = self.get_last_close(self.df.index[0].year, self.df.index[0].month)
+        close = self.df["Adj Close"].to_numpy(dtype=float)
+        if rows:
+            last_close = close[rows - 1]
+        else:
+            last_close = self.get_last_close(
+                self.df.index[0].year, self.df.index[0].month
+            )
+        if not last_close:
+            last_close = close[0]
         time_now = time_eastern(True)
 
-        self.df["last_month_day"] = 0
-        for i in range(len(self.df) - 1):
-            # get closing value of last year
-            row = self.df.iloc[i]
-            ind = row.name
-            next_row_ind = self.df.iloc[i + 1].name
-            adj_close = row["Adj Close"]
+        # integer month codes (year * 12 + month)
+        month_keys = self.df.index.year.to_numpy() * 12 + self.df.index.month.to_numpy()
+        now_key = time_now.year * 12 + time_now.month
 
-            if f"{ind.month}_{ind.year}" not in monthly_returns:
-                monthly_returns[f"{ind.month}_{ind.year}"] = last_close
+        # the next row starts a new month, dont count last month (the one in progress)
+        # the row before the recalculated ones is included, its month might have been in progress
+        flag_rows = max(rows - 1, 0)
+        keys = month_keys[flag_rows:]
+        last_month_day = np.zeros(len(keys), dtype=np.int8)
+        last_month_day[:-1] = (keys[1:] != keys[:-1]) & (keys[1:] != now_key)
+        self.set_column("last_month_day", flag_rows, last_month_day)
 
-            # dont count last month
-            if next_row_ind.month != ind.month and not (
-                next_row_ind.month == time_now.month
-                and next_row_ind.year == time_now.year
-            ):
-                self.df.loc[ind, "last_month_day"] = 1
+        original = self.period_open(close[rows:], month_keys[rows:], last_close)
+        self.set_column(
+            "monthly_increase",
+            rows,
+            self.perc_increase(original, close[rows:]).astype(np.float32),
+        )
 
-            last_close = adj_close
+    @staticmethod
+    def process_group_data(df, keys, column="monthly_increase"):
+        """
+        Calculate avg, max, date of the max and positive frequency of every group in one sorted pass
 
-        if f"{time_now.month}_{time_now.year}" not in monthly_returns:
-            monthly_returns[f"{time_now.month}_{time_now.year}"] = last_close
+        :param df: prepared data
+        :param keys: group key of every row of df (month, day...)
+        :param column: column the statistics are calculated from
+        """
+        if not len(keys):
+            return pd.DataFrame(columns=["avg", "max", "max_date", "freq"])
 
-        self.df["monthly_increase"] = self.df.apply(
-            lambda row: self.perc_increase(
-                monthly_returns[f"{row.name.month}_{row.name.year}"], row["Adj Close"]
-            ),
-            axis=1,
-        )
-        self.df["daily_increase"] = self.perc_increase(
-            self.df["Adj Close"].shift(1), self.df["Adj Close"]
+        order = np.argsort(np.asarray(keys), kind="stable")
+        keys = np.asarray(keys)[order]
+        values = df[column].to_numpy(dtype=float)[order]
+
+        # segment of every group in the sorted data
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        sizes = np.diff(np.r_[starts, len(keys)])
+        segment = np.repeat(np.arange(len(starts)), sizes)
+
+        valid = ~np.isnan(values)
+        counts = np.add.reduceat(valid, starts)
+        filled = np.where(valid, values, -np.inf)
+        max_vals = np.maximum.reduceat(filled, starts)
+
+        # first (oldest) row reaching the max of its group
+        is_max = valid & (filled == max_vals[segment])
+        max_rows = np.minimum.reduceat(
+            np.where(is_max, np.arange(len(keys)), len(keys)), starts
         )
+        found = max_rows < len(keys)
+        max_dates = df.index[order[np.where(found, max_rows, 0)]].where(found)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return pd.DataFrame(
+                {
+                    "avg": np.add.reduceat(np.where(valid, values, 0), starts) / counts,
+                    "max": np.where(counts > 0, max_vals, np.nan),
+                    "max_date": max_dates,
+                    "freq": np.add.reduceat(values > 0, starts) / sizes * 100,
+                },
+                index=keys[starts],
+            )
 
-    def process_group_data(self, df_grouped):
-        df_monthly_avg = df_grouped["monthly_increase"].mean()
-        df_monthly_max = df_grouped["monthly_increase"].max()
-        df_monthhly_max_index = df_grouped["monthly_increase"].idxmax()
-        df_monthhly_freq = df_grouped["monthly_increase"].apply(self.calc_freq)
-        df = pd.concat(
-            [df_monthly_avg, df_monthly_max, df_monthhly_max_index, df_monthhly_freq],
-            axis=1,
+    @stage_time.time(stage="monthly_stats")
+    def get_monthly_stats(self, df=None):
+        """Raw monthly statistics, calculated from the last days of months"""
+        df = self.df if df is None else df
+        df_monthly = df[df["last_month_day"] == 1]
+        return self.process_group_data(
+            df_monthly, df_monthly["month_day"].to_numpy() // 100
         )
-        df.columns = ["avg", "max", "max_date", "freq"]
 
-        return df
+    @stage_time.time(stage="daily_stats")
+    def get_daily_stats(self, df=None):
+        """Raw statistics of every calendar day"""
+        df = self.df if df is None else df
+        return self.process_group_data(df, df["month_day"].to_numpy())
+
+    @stage_time.time(stage="tables")
+    def get_data(self, monthly_data=None, daily_data=None):
+        """Calculate avg % return, win frequency and max return"""
+
+        if monthly_data is None:
+            monthly_data = self.get_monthly_stats()
+        if daily_data is None:
+            daily_data = self.get_daily_stats()
+
+        monthly_data = prettify_table(compact_table(monthly_data), "Month")
+        daily_data = prettify_table(compact_table(daily_data), "Day")
+
+        return monthly_data, daily_data
+
+
+class CumulativeStats:
+    """
+    Values of one column laid out to (year, group) cells, every group has at most one row per year.
+    The cells are cumulated from the newest year back, so statistics of any window ending now are
+    a lookup of the cumulated full years plus the cells of its partial first year
+    """
+
+    def __init__(self, years, columns, values, month_day, n_years, keys, first_year):
+        """
+        :param years: year of every row, counted from the first year of the history
+        :param columns: group column of every row (index to keys)
+        :param values: value of every row
+        :param month_day: calendar key (month * 100 + day) of the date of every row
+        :param n_years: number of years in the history
+        :param keys: calendar key of every group column
+        :param first_year: first year of the history
+        """
+        shape = (n_years, len(keys))
+        self.keys = keys
+        self.first_year = first_year
+        # every group column lies in one month, the cells keep only the day of the month of their date
+        self.months = np.zeros(len(keys), dtype=np.int8)
+        self.months[columns] = month_day // 100
+        self.present = np.zeros(shape, dtype=bool)
+        self.present[years, columns] = True
+        # same float32 as the prepared columns
+        self.values = np.full(shape, np.nan, dtype=np.float32)
+        self.values[years, columns] = values
+        self.days = np.zeros(shape, dtype=np.int8)
+        self.days[years, columns] = month_day % 100
+        self.accumulate()
+
+    def __getstate__(self):
+        # only the cells are persisted, the cumulated arrays are rebuilt when loaded
+        return {
+            "keys": self.keys,
+            "first_year": self.first_year,
+            "months": self.months,
+            "present": self.present,
+            "values": self.values,
+            "days": self.days,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "sums" not in state:
+            self.accumulate()
 
-    def prettify_tables(self, df, index_name):
+    def shared_state(self):
+        """Cells with the cumulated arrays, the shared snapshot is attached without recalculation"""
+        return dict(self.__dict__)
 
-        format_str = "%m" if index_name == "Month" else "%m-%d"
-        # df.index = pd.to_datetime(df.index, format=format_str).month_name().str.slice(stop=3)
-        df = df.drop("02-29", axis=0, errors="ignore")
-        df.index = pd.to_datetime(df.index, format=format_str).strftime(
-            format_str.replace("m", "b")
+    def accumulate(self):
+        """Cumulates the cells from the newest year back"""
+        n_years = len(self.present)
+        keys = self.keys
+        valid = self.present & ~np.isnan(self.values)
+        self.valid = valid
+        # row y holds the totals of the years y and newer, the extra last row is empty
+        # counts of years fit int16, sums stay float64 not to lose precision over long windows
+        self.rows = self.suffix_sum(self.present, np.int16)
+        self.counts = self.suffix_sum(valid, np.int16)
+        self.sums = self.suffix_sum(np.where(valid, self.values, 0), np.float64)
+        self.positive = self.suffix_sum(valid & (self.values > 0), np.int16)
+
+        filled = np.where(valid, self.values, -np.inf)
+        self.maxs = np.full((n_years + 1, len(keys)), -np.inf, dtype=np.float32)
+        self.maxs[:-1] = np.maximum.accumulate(filled[::-1], axis=0)[::-1]
+        # oldest year reaching the max of the newer years
+        is_max = valid & (filled == self.maxs[:-1])
+        max_years = np.where(is_max, np.arange(n_years)[:, None], n_years)
+        self.max_years = np.full((n_years + 1, len(keys)), n_years, dtype=np.int16)
+        self.max_years[:-1] = np.minimum.accumulate(max_years[::-1], axis=0)[::-1]
+
+    @staticmethod
+    def suffix_sum(values, dtype):
+        res = np.zeros((len(values) + 1, values.shape[1]), dtype=dtype)
+        res[:-1] = np.cumsum(values[::-1], axis=0, dtype=dtype)[::-1]
+        return res
+
+    def day_codes(self, year):
+        """Calendar key (month * 100 + day) of the dates of the cells of the year"""
+        return self.months.astype(np.int16) * 100 + self.days[year]
+
+    def cell_dates(self, years, columns):
+        """
+        Dates of the cells, NaT for the empty cells and the year after the history
+
+        :param years: years of the cells, counted from the first year of the history
+        :param columns: group columns of the cells, broadcast with years
+        """
+        n_years = len(self.present)
+        inside = years < n_years
+        years = np.minimum(years, n_years - 1).astype(np.int64)
+        days = self.days[years, columns]
+        months = (self.first_year + years - 1970) * 12 + self.months[columns] - 1
+        dates = months.astype("datetime64[M]").astype("datetime64[D]") + (days - 1)
+        return np.where(
+            inside & (days > 0),
+            dates.astype("datetime64[ns]"),
+            np.datetime64("NaT", "ns"),
         )
 
-        df.index.names = [index_name]
-        df["avg"] = (df["avg"] * 100).round(2).astype(str) + "%"
-        df["max"] = (
-            (df["max"] * 100).round(2).astype(str)
-            + "% ("
-            + df["max_date"].dt.year.astype(str)
-            + ")"
+    def window_cells(self, year, start):
+        """
+        Values and dates of the cells of the years since start, values of the cells before start are NaN
+
+        :param year: year of the start, counted from the first year of the history
+        :param start: first date of the window
+        """
+        n_years = len(self.present)
+        first = min(max(year, 0), n_years)
+        values = self.values[first:].astype(float)
+        if 0 <= year < n_years:
+            values[0, self.day_codes(year) < start.month * 100 + start.day] = np.nan
+        years = np.arange(first, n_years)[:, None]
+        return values, self.cell_dates(years, np.arange(len(self.keys)))
+
+    def window(self, year, start):
+        """
+        Returns count of rows, count of valid values, sum, count of positive values, max and date
+        of the max of every group for the rows since start
+
+        :param year: year of the start, counted from the first year of the history
+        :param start: first date of the window
+        """
+        n_years = len(self.present)
+        full = min(max(year + 1, 0), n_years)
+        columns = np.arange(len(self.keys))
+
+        rows = self.rows[full].copy()
+        counts = self.counts[full].copy()
+        sums = self.sums[full].copy()
+        positive = self.positive[full].copy()
+        maxs = self.maxs[full].copy()
+        max_dates = self.cell_dates(self.max_years[full], columns)
+
+        if 0 <= year < n_years:
+            # first year of the window is partial
+            included = self.present[year] & (
+                self.day_codes(year) >= start.month * 100 + start.day
+            )
+            valid = included & self.valid[year]
+            values = np.where(valid, self.values[year], 0)
+            rows += included
+            counts += valid
+            sums += values
+            positive += valid & (values > 0)
+            # older row wins the ties, same as with the sorted pass
+            newer = valid & (values >= maxs)
+            maxs = np.where(newer, values, maxs)
+            max_dates = np.where(newer, self.cell_dates(year, columns), max_dates)
+
+        return rows, counts, sums, positive, maxs, max_dates
+
+
+class SeasonalScanner:
+    """
+    Scans every pair of entry and exit calendar day, buying at the close of the entry day and selling
+    at the close of the exit day of the same year. Log closes are laid out to (year, calendar day)
+    cells, so returns of all the pairs of all the years are differences of two cells
+    """
+
+    def __init__(self, close):
+        """
+        :param close: Adj Close series of the history indexed by date
+        """
+        index = close.index
+        self.first_year = index[0].year
+        n_years = index[-1].year - self.first_year + 1
+
+        # cells of every (year, month * 31 + day), non trading days hold the last close before them
+        cells = (
+            (index.year.to_numpy() - self.first_year) * 372
+            + (index.month.to_numpy() - 1) * 31
+            + index.day.to_numpy()
+            - 1
         )
-        df["freq"] = (df["freq"]).round(1).astype(str) + "%"
-        df = df.drop(labels="max_date", axis=1)
-        if index_name == "Day":
-            index_name = "Dai"
-        df.columns = [
-            f"Average {index_name}ly % gain",
-            f"Max {index_name}ly % gain",
-            f"{index_name}ly gain frequency",
+        grid = np.full(n_years * 372, np.nan)
+        grid[cells] = np.log(close.to_numpy(dtype=float))
+        filled = np.maximum.accumulate(
+            np.where(np.isnan(grid), 0, np.arange(len(grid)))
+        )
+        grid = grid[filled]
+        # the future is unknown
+        grid[cells[-1] + 1 :] = np.nan
+
+        # only real calendar days (of a leap year)
+        columns = [
+            (month - 1) * 31 + day - 1
+            for month in range(1, 13)
+            for day in range(1, monthrange(2000, month)[1] + 1)
         ]
+        self.keys = np.array(
+            [(col // 31 + 1) * 100 + col % 31 + 1 for col in columns], dtype=np.int16
+        )
+        self.log_close = grid.reshape(n_years, 372)[:, columns]
 
-        return df
+    def scan(self, past, years, min_days=1, max_days=366, top=20, chunk=32):
+        """
+        Returns the best non overlapping entry and exit day pairs by average gain since past
 
-    def get_data(self):
-        """Calculate avg % return, win frequency and max return"""
+        :param past: first date of the window
+        :param years: lookback of the window in years, pairs need at least years - 1 years of data
+        :param min_days: shortest holding in calendar days
+        :param max_days: longest holding in calendar days
+        :param top: number of returned pairs
+        :param chunk: number of entry days evaluated at once, bounds the memory
+        """
+        first = max(past.year - self.first_year, 0)
+        grid = self.log_close[first:].copy()
+        if past.year >= self.first_year:
+            grid[0, self.keys < past.month * 100 + past.day] = np.nan
 
-        df_monthly = self.df[self.df["last_month_day"] == 1]
-        df_monthly = df_monthly.groupby(df_monthly.index.strftime("%m"))
-        monthly_data = self.process_group_data(df_monthly)
+        n_days = len(self.keys)
+        shape = (n_days, n_days)
+        avg, freq, worst = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+        worst_year, count = np.zeros(shape, dtype=np.int64), np.zeros(shape)
+        for start in range(0, n_days, chunk):
+            end = min(start + chunk, n_days)
+            # (year, entry, exit) log returns
+            returns = grid[:, None, :] - grid[:, start:end, None]
+            valid = ~np.isnan(returns)
+            gains = np.expm1(np.where(valid, returns, 0))
+            counts = valid.sum(axis=0)
+            rows = np.where(valid, returns, np.inf).argmin(axis=0)
 
-        df_daily = self.df.groupby(self.df.index.strftime("%m-%d"))
-        daily_data = self.process_group_data(df_daily)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                avg[start:end] = gains.sum(axis=0) / counts
+                freq[start:end] = (valid & (returns > 0)).sum(axis=0) / counts * 100
+            worst[start:end] = np.take_along_axis(gains, rows[None], axis=0)[0]
+            worst_year[start:end] = self.first_year + first + rows
+            count[start:end] = counts
 
-        monthly_data = self.prettify_tables(monthly_data, "Month")
-        daily_data = self.prettify_tables(daily_data, "Day")
+        position = np.arange(n_days)
+        days = position[None, :] - position[:, None]
+        eligible = (
+            (days >= min_days) & (days <= max_days) & (count >= max(years - 1, 1))
+        )
 
-        return monthly_data, daily_data
+        candidates = np.flatnonzero(eligible)
+        candidates = candidates[np.argsort(-avg.ravel()[candidates], kind="stable")]
+        # greedy pick of the best pairs not holding on the same days
+        held = np.zeros(n_days, dtype=bool)
+        picked = []
+        for candidate in candidates:
+            entry, exit_ = divmod(candidate, n_days)
+            if held[entry + 1 : exit_ + 1].any():
+                continue
+            held[entry + 1 : exit_ + 1] = True
+            picked.append(candidate)
+            if len(picked) == top:
+                break
 
+        entry, exit_ = np.divmod(np.array(picked, dtype=np.int64), n_days)
+        return pd.DataFrame(
+            {
+                "entry": self.keys[entry],
+                "exit": self.keys[exit_],
+                "days": days[entry, exit_],
+                "avg": avg[entry, exit_],
+                "freq": freq[entry, exit_],
+                "worst": worst[entry, exit_],
+                "worst_year": worst_year[entry, exit_],
+                "years": count[entry, exit_].astype(np.int64),
+            }
+        )
 
-def main(years):
+    @staticmethod
+    def prettify(df):
+        return pd.DataFrame(
+            {
+                "Entry": [calendar_label(key) for key in df["entry"]],
+                "Exit": [calendar_label(key) for key in df["exit"]],
+                "Days": df["days"],
+                "Average % gain": (df["avg"] * 100).round(2).astype(str) + "%",
+                "Gain frequency": df["freq"].round(1).astype(str) + "%",
+                "Worst year": (df["worst"] * 100).round(2).astype(str)
+                + "% ("
+                + df["worst_year"].astype(str)
+                + ")",
+                "Years": df["years"],
+            }
+        )
+
+
+class SpxAggregates:
+    """
+    Cumulative statistics of the prepared history, raw seasonality and monthly and daily statistics
+    of any lookback up to max_years come from them without touching the rows. Also holds the seasonal
+    scanner of the history
+    """
+
+    def __init__(self, df, max_years, nw=None, symbol=None, figure_points=None):
+        """
+        :param df: prepared history of the longest window
+        :param max_years: longest lookback the history covers
+        :param nw: end (exclusive) of the windows, the last completed session by default
+        :param symbol: symbol of the history
+        :param figure_points: number of points the raw trace of the graphs is reduced to, see figure_json
+        """
+        self.symbol = symbol
+        self.figure_points = figure_points
+        self.max_years = max_years
+        self.nw = nw if nw is not None else get_window_range(max_years)[1]
+        self.first_year = df.index[0].year
+        self.scanner = SeasonalScanner(df["Adj Close"])
+
+        years = df.index.year.to_numpy() - self.first_year
+        n_years = years[-1] + 1
+        month_day = df["month_day"].to_numpy().astype(np.int64)
+        # every calendar day has its column (month * 31 + day) in the order of the keys
+        day_columns = (month_day // 100 - 1) * 31 + month_day % 100 - 1
+        day_keys = np.array(
+            [month * 100 + day for month in range(1, 13) for day in range(1, 32)],
+            dtype=np.int16,
+        )
+        self.seasonality = CumulativeStats(
+            years,
+            day_columns,
+            df["increase"].to_numpy(),
+            month_day,
+            n_years,
+            day_keys,
+            self.first_year,
+        )
+        # same column as get_daily_stats
+        self.daily = CumulativeStats(
+            years,
+            day_columns,
+            df["monthly_increase"].to_numpy(),
+            month_day,
+            n_years,
+            day_keys,
+            self.first_year,
+        )
+
+        month_end = df["last_month_day"].to_numpy() == 1
+        self.monthly = CumulativeStats(
+            years[month_end],
+            month_day[month_end] // 100 - 1,
+            df["monthly_increase"].to_numpy()[month_end],
+            month_day[month_end],
+            n_years,
+            np.arange(1, 13, dtype=np.int16),
+            self.first_year,
+        )
+
+    def group_stats(self, stats, start):
+        """Avg, max, date of the max and positive frequency of every group present since start"""
+        rows, counts, sums, positive, maxs, max_dates = stats.window(
+            start.year - self.first_year, start
+        )
+        keep = rows > 0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return pd.DataFrame(
+                {
+                    "avg": sums / counts,
+                    "max": np.where(counts > 0, maxs, np.nan),
+                    "max_date": pd.DatetimeIndex(max_dates),
+                    "freq": positive / rows * 100,
+                },
+                index=stats.keys,
+            )[keep].join(self.distribution(stats, start))
+
+    def distribution(self, stats, start):
+        """Distribution statistics of every group since start from the cells of the window"""
+        values, dates = stats.window_cells(start.year - self.first_year, start)
+        keys = np.broadcast_to(stats.keys, values.shape)
+        # cells are ordered by year, ties of the min resolve to the oldest one
+        return segment_distribution(keys.ravel(), values.ravel(), dates.ravel())
+
+    def window(self, years):
+        """Raw seasonality, monthly and daily statistics of the last given years"""
+        if not 1 <= years <= self.max_years:
+            raise KeyError(years)
+        past, _ = get_window_range(years, self.nw)
+
+        rows, counts, sums, _, _, _ = self.seasonality.window(
+            past.year - self.first_year, past
+        )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            seasonality = pd.Series(
+                sums / counts,
+                index=pd.Index(self.seasonality.keys, name="month_day"),
+                name="increase",
+            )[rows > 0]
+
+        return (
+            seasonality,
+            self.group_stats(self.monthly, past),
+            self.group_stats(self.daily, past),
+        )
 
-    sp = SpxData(years)
-    sp.prepare_graph()
+    def scan(self, years, max_days=30, top=20):
+        """Table of the best entry and exit days of the last given years, holding at most max_days"""
+        if not 1 <= years <= self.max_years:
+            raise KeyError(years)
+        past, _ = get_window_range(years, self.nw)
+        return self.scanner.prettify(
+            self.scanner.scan(past, years, max_days=max_days, top=top)
+        )
+
+    def results(self, years):
+        """
+        Graph (serialized by figure_json), monthly and daily table of the last given years, the tables
+        are numeric (compact_table) and formatted by prettify_table when shown
+        """
+        seasonality, monthly, daily = self.window(years)
+        sp = SpxData(years, pd.DataFrame(), symbol=self.symbol)
+        return (
+            figure_json(sp.plot_seasonality(seasonality), self.figure_points),
+            compact_table(monthly),
+            compact_table(daily),
+        )
+
+
+class SpxWindows:
+    """
+    Multi window engine. Downloads and prepares the longest lookback only once, statistics of every
+    shorter window come from the cumulative aggregates of it. Later refreshes are incremental, see update
+    """
+
+    def __init__(self, windows, provider=None, symbol=None, figure_points=None):
+        """
+        :param figure_points: number of points the raw trace of the graphs is reduced to, all by default
+        """
+        self.windows = sorted(set(windows))
+        self.figure_points = figure_points
+        self.history = SpxData(self.windows[-1], provider=provider, symbol=symbol)
+        self.symbol = self.history.symbol
+        self.history.prepare_calendar()
+        self.history.prepare_graph()
+        self.history.prepare_averages()
+        nw = get_window_range(self.windows[-1])[1]
+        self.aggregates = SpxAggregates(
+            self.history.df,
+            self.history_years(nw),
+            nw,
+            symbol=self.symbol,
+            figure_points=figure_points,
+        )
+
+    def history_years(self, nw):
+        """
+        Longest lookback the history covers, symbols younger than the longest window have a shorter one.
+        A lookback is covered when there is a close before its start
+
+        :param nw: end (exclusive) of the windows
+        """
+        first = self.history.closes.index[0]
+        years = self.windows[-1]
+        while years > 1 and get_window_range(years, nw)[0] <= first:
+            years -= 1
+        return years
+
+    @stage_time.time(stage="update")
+    def update(self):
+        """
+        Incremental refresh. Downloads only the bars after the last stored date, recalculates the
+        derived columns of the affected year and month and rebuilds the aggregates
+        """
+        sp = self.history
+        last_date = sp.df.index[-1]
+        past, nw = get_window_range(self.windows[-1])
+
+        new_rows = len(sp.df)
+        start = last_date + datetime.timedelta(days=1)
+        # no new bar can exist over a weekend
+        if start < nw and np.busday_count(start.date(), nw.date()):
+            new = sp.download_spx(start, nw)
+            new = new[new.index > last_date]
+            if len(new):
+                sp.append_prices(new)
+                for column in sp.df.columns.difference(new.columns):
+                    new[column] = np.zeros(len(new), dtype=sp.df[column].dtype)
+                sp.df = pd.concat([sp.df, new[sp.df.columns]])
+                sp.set_closes(pd.concat([sp.closes, new["Adj Close"]]), sp.closes_start)
+
+        index = sp.df.index
+        year_rows = index.searchsorted(datetime.datetime(last_date.year, 1, 1))
+        month_rows = index.searchsorted(
+            datetime.datetime(last_date.year, last_date.month, 1)
+        )
+        sp.prepare_calendar(new_rows)
+        sp.prepare_graph(year_rows)
+        sp.prepare_averages(month_rows)
+
+        # keep only the longest window in the history
+        sp.df = sp.df.iloc[index.searchsorted(past) :]
+        start = sp.margin_start(past)
+        sp.set_closes(sp.closes[sp.closes.index >= start], start)
+        self.aggregates = SpxAggregates(
+            sp.df, self.history_years(nw), nw, self.symbol, self.figure_points
+        )
+
+    def get_results(self):
+        figs, monthly_data, daily_data = {}, {}, {}
+        # windows longer than the history are cut to it
+        for years in sorted({min(w, self.aggregates.max_years) for w in self.windows}):
+            figs[years], monthly_data[years], daily_data[years] = (
+                self.aggregates.results(years)
+            )
+
+        return figs, monthly_data, daily_data
+
+
+def refresh_symbol(engine, windows, provider, symbol, figure_points=None):
+    """
+    Creates (or incrementally updates) the engine of the symbol, runs in a worker process of the
+    symbols pool. Returns the engine, its results (both None when the refresh failed) and the metrics
+    recorded by the worker meanwhile
+
+    :param engine: SpxWindows of the symbol from the previous refresh, None for the first one
+    :param figure_points: see SpxWindows
+    """
+    # the worker keeps its registry between tasks, only this task is reported
+    registry.reset()
+    try:
+        if engine is None:
+            engine = SpxWindows(windows, provider, symbol, figure_points)
+        else:
+            engine.update()
+        return engine, engine.get_results(), registry.export()
+    except Exception:
+        traceback.print_exc()
+        return None, None, registry.export()
+
+
+def main(years):
+    figs, monthly_data, daily_data = main_multi([years])
+    return figs[years], monthly_data[years], daily_data[years]
 
-    fig = sp.plot_seasonality()
-    sp.prepare_averages()
-    monthly_data, daily_data = sp.get_data()
 
-    return fig, monthly_data, daily_data
+def main_multi(windows, provider=None, symbol=None):
+    """Calculates graphs and tables for all the lookback windows (in years) from one price history"""
+    return SpxWindows(windows, provider, symbol).get_results()
 
 
 if __name__ == "__main__":
     years = 50
-    fig = main(years)
-    fig.show()
+    fig, _, _ = main(years)
+    pio.from_json(fig).show()
@@ -1,16 +1,32 @@
 import dash
 from dash import html
-from dash.dependencies import Input, Output
-from dash import dcc
-from flask import Flask
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
+from dash import ctx, dcc, no_update
+from flask import Flask, Response, abort, jsonify, make_response, request
 import generate_graph
+import numpy as np
+import pandas as pd
 from help_functions import *
 from dash import dash_table as dt
 import traceback
 import threading
+import hashlib
+import json
 import os
+import pickle
+import socket
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from waitress import serve
-
+from response_cache import ResponseCache
+from compression import ResponseCompression
+from snapshot import Snapshot, SymbolResults, SharedSnapshotReader
+from scheduler import RefreshScheduler
+from market_calendar import last_completed_session, now_eastern
+from providers import get_provider
+from metrics import registry, callback_time, refresh_time, refresh_failures, data_age
 
 server = Flask(__name__)
 server.secret_key = "test"
@@ -18,7 +34,31 @@ config = open_json("config.json")
 
 app = dash.Dash(__name__, server=server)
 app.title = "Market seasonality - trading data"
+# gzip / brotli responses, long-lived caching of the versioned bundles and assets
+compression = ResponseCompression(server, level=config.get("compression_level", 6))
 logs_directory = "logs"
+# lookback windows (in years) offered on the page, all computed from one price history
+windows = sorted(config.get("windows", [10, 20, 30, 40, 50]))
+# symbols offered on the page, every one is computed independently in the symbols pool
+symbols = config.get("symbols", ["^GSPC"])
+# built outputs of update_graph, cleared every time new data are published
+response_cache = ResponseCache(config.get("response_cache_size", 512))
+# currently served results of all symbols, replaced as a whole by datas_thread (see publish)
+snapshot = None
+snapshot_path = f"{logs_directory}/snapshot.pickle"
+# with serving_processes the refreshes run in the main (compute) process, which publishes every
+# snapshot to the shared file the serving processes attach (see serve_processes)
+serving_processes = config.get("serving_processes", 0)
+shared_snapshot_path = config.get(
+    "shared_snapshot", f"{logs_directory}/snapshot.shared"
+)
+status_path = f"{logs_directory}/status.json"
+# every process publishes its metrics there, /metrics of a serving process renders them merged
+metrics_directory = f"{logs_directory}/metrics"
+# published metrics of this process, set only when serving from several processes
+metrics_path = None
+# SharedSnapshotReader of a serving process
+shared = None
 
 months = [
     "Jan",
@@ -36,6 +76,15 @@ months = [
 ]
 text_center = {"text-align": "center"}
 table_center = {"marginLeft": "auto", "marginRight": "auto"}
+# longest holding (calendar days) offered by the seasonal windows scanner
+holding_periods = {
+    "1 week": 7,
+    "2 weeks": 14,
+    "1 month": 30,
+    "2 months": 60,
+    "3 months": 91,
+    "6 months": 182,
+}
 dropdown_center = {
     "display": "flex",
     "align-items": "center",
@@ -56,6 +105,7 @@ class Webpage:
 
     def start_server(self):
         self.wait_to_start()
+        compression.precompress(server)
         if config["is_test"]:
             app.run_server(debug=True, use_reloader=False)
         else:
@@ -72,11 +122,11 @@ class Webpage:
         app.layout = html.Div(
             [
                 # TITLE + TEXT
-                html.H1("SPX seasonality", style=text_center),
+                html.H1("Market seasonality", style=text_center),
                 html.P(
                     [
-                        "This website measures SPX performance / seasonality over the last selected years showing historical"
-                        " market sentiment.",
+                        "This website measures performance / seasonality of the selected market over the last selected years"
+                        " showing historical market sentiment.",
                         html.Br(),
                         "This site is updated daily and always has the newest information. The point of this project is to "
                         "make a better daily trading decisions based on the past data.",
@@ -88,25 +138,40 @@ class Webpage:
                     ],
                     style=text_center,
                 ),
+                self.dropdown(
+                    "Select market",
+                    "symbol",
+                    [
+                        {"label": generate_graph.symbol_name(symbol), "value": symbol}
+                        for symbol in symbols
+                    ],
+                    symbols[0],
+                ),
                 html.Br(),
                 # FIRST GRAPH MONTHLY
                 html.H2("This month seasonality", style=text_center),
                 html.P(
-                    "Table containing averaged SPX performance over the last 50, 40, 30, 20, 10 years. "
+                    f"Table containing averaged performance over the last {', '.join(str(y) for y in reversed(windows))} years. "
                     "Each value is calculated as close of the last month and close of the current month.",
                     style=text_center,
                 ),
                 self.dropdown("select month", "this_next_month"),
-                html.Div(id="monthly_first", style={"width": "80%", **table_center}),
+                html.Div(
+                    self.table("monthly_first", "lightgreen"),
+                    style={"width": "80%", **table_center},
+                ),
                 html.Br(),
                 # FIRST GRAPH DAILY
-                html.H2("Today's SPX seasonality", style=text_center),
+                html.H2("Today's seasonality", style=text_center),
                 html.P(
                     "Each value is calculated as close of the last day and close of the current day",
                     style=text_center,
                 ),
                 self.dropdown("select day", "this_next_day"),
-                html.Div(id="daily_first", style={"width": "80%", **table_center}),
+                html.Div(
+                    self.table("daily_first", "lightgreen"),
+                    style={"width": "80%", **table_center},
+                ),
                 html.Br(),
                 html.Br(),
                 html.H2("PART 2: ALL HISTORICAL DATA", style=text_center),
@@ -120,32 +185,48 @@ class Webpage:
                     style=text_center,
                 ),
                 # DROPDOWN + GRAPH
+                # any lookback up to the longest window, built from the aggregates
                 self.dropdown(
-                    "Select SPX performance period",
+                    "Select performance period",
                     "slct",
                     [
-                        {"label": "10 years", "value": 10},
-                        {"label": "20 years", "value": 20},
-                        {"label": "30 years", "value": 30},
-                        {"label": "40 years", "value": 40},
-                        {"label": "50 years", "value": 50},
+                        {"label": f"{y} year{'s' if y > 1 else ''}", "value": y}
+                        for y in range(1, windows[-1] + 1)
                     ],
-                    50,
+                    windows[-1],
+                    searchable=True,
                 ),
                 dcc.Graph(id="spx_graph", figure={}, style={"height": "90vh"}),
+                # graph serialized when the data were refreshed, parsed in the browser
+                dcc.Store(id="figure_json"),
+                dcc.Checklist(
+                    id="distribution",
+                    options=[
+                        {
+                            "label": " Show distribution of the gains in the tables (median, quartiles, std, min, "
+                            "downside deviation)",
+                            "value": "show",
+                        }
+                    ],
+                    value=[],
+                    style=text_center,
+                ),
                 # MONTHLY TABLE
                 html.H2(id="monthly_title", style=text_center),
                 html.P(
-                    "Table containing averaged SPX performance over the selected years grouped monthly. Each value is calculated "
+                    "Table containing averaged performance over the selected years grouped monthly. Each value is calculated "
                     "as close of the last month and close of the current month",
                     style=text_center,
                 ),
-                html.Div(id="table_monthly", style={"width": "80%", **table_center}),
+                html.Div(
+                    self.table("table_monthly", "lightgrey", page_size=12),
+                    style={"width": "80%", **table_center},
+                ),
                 html.Br(),
                 # DAILY TABLE
                 html.H2(id="daily_title", style=text_center),
                 html.P(
-                    "Table containing averaged SPX performance over the selected years grouped by every day. Each value is "
+                    "Table containing averaged performance over the selected years grouped by every day. Each value is "
                     "calculated as close of the last day and close of the current day",
                     style=text_center,
                 ),
@@ -154,16 +235,42 @@ class Webpage:
                     "pick_month",
                     [{"label": st, "value": st} for st in months],
                 ),
-                html.Div(id="table_daily", style={"width": "80%", **table_center}),
+                html.Div(
+                    self.table("table_daily", "lightgrey", page_size=12),
+                    style={"width": "80%", **table_center},
+                ),
+                html.Br(),
+                # SEASONAL WINDOWS SCANNER
+                html.H2(id="scanner_title", style=text_center),
+                html.P(
+                    "Every pair of entry and exit day over the selected years is evaluated, buying at the close of "
+                    "the entry day and selling at the close of the exit day. Table shows the best non overlapping "
+                    "windows by the average gain with their gain frequency and the worst year",
+                    style=text_center,
+                ),
+                self.dropdown(
+                    "Select max holding period",
+                    "holding",
+                    [
+                        {"label": label, "value": days}
+                        for label, days in holding_periods.items()
+                    ],
+                    holding_periods["1 month"],
+                ),
+                html.Div(id="table_scanner", style={"width": "80%", **table_center}),
                 html.P("@Richard Volčko", style={"text-align": "right"}),
+                # data of the selected lookback and of the first tables, rendered in the browser
+                dcc.Store(id="window_data"),
+                dcc.Store(id="first_data"),
+                dcc.Store(id="first_version"),
             ]
         )
 
-    def dropdown(self, txt, _id, options=None, value=None):
+    def dropdown(self, txt, _id, options=None, value=None, searchable=False):
         args = {
             "id": _id,
             "multi": False,
-            "searchable": False,
+            "searchable": searchable,
             "style": {"width": "40%", "verticalAlign": "middle"},
         }
         if options:
@@ -185,187 +292,722 @@ class Webpage:
             style=dropdown_center,
         )
 
-    def transform_pandas(self, df, daily_month=0):
-        if daily_month:
-            df = df[df.index.str.contains(daily_month)]
-            if_query = {
-                "if": {
-                    "filter_query": f'{{Day}}="{time_eastern()[0]}-{time_eastern()[1]}"'
-                }
-            }
-        else:
-            if_query = {"if": {"filter_query": f'{{Month}}="{time_eastern()[0]}"'}}
-
-        df = df.reset_index(level=0)
-        data = df.to_dict("records")
-
-        columns = [
-            {
-                "name": i,
-                "id": i,
-            }
-            for i in df.columns
-        ]
-        current_page = (
-            (int(time_eastern()[1]) + 1) // 12
-            if daily_month == time_eastern()[0]
-            else 0
-        )
+    def table(self, _id, header_color, page_size=None):
+        """Empty table filled in by the tables clientside callback"""
+        args = {"page_size": page_size} if page_size else {}
         return dt.DataTable(
-            data=data,
-            columns=columns,
+            id=_id,
             style_cell={"textAlign": "center", "border": "1px solid grey"},
-            style_data_conditional=[
-                {
-                    **if_query,
-                    "backgroundColor": "lightblue",
-                }
-            ],
-            # style_data={'border': '1px solid blue'},
             style_header={
                 "border": "1px solid black",
-                "backgroundColor": "lightgrey",
+                "backgroundColor": header_color,
                 "padding": "1.4rem 1rem",
                 "font-size": "16px",
             },
-            page_size=12,
-            page_current=current_page,
+            **args,
         )
 
-    def first_table(self, df, this_next):
-        res = []
-
-        for y in 50, 40, 30, 20, 10:
-            if "-" in this_next:
-                res.append(
-                    {
-                        "Period": f"{y} years",
-                        "Day": this_next,
-                        **df[y].loc[this_next].to_dict(),
-                    }
-                )
-            else:
-                res.append(
-                    {
-                        "Period": f"{y} years",
-                        "Month": this_next,
-                        **df[y].loc[this_next].to_dict(),
-                    }
-                )
-
-        columns = [
-            {
-                "name": i,
-                "id": i,
-            }
-            for i in res[0]
-        ]
+    def scanner_table(self, df):
         return dt.DataTable(
-            data=res,
-            columns=columns,
+            data=df.to_dict("records"),
+            columns=[{"name": i, "id": i} for i in df.columns],
             style_cell={"textAlign": "center", "border": "1px solid grey"},
             style_header={
                 "border": "1px solid black",
-                "backgroundColor": "lightgreen",
+                "backgroundColor": "lightgrey",
                 "padding": "1.4rem 1rem",
                 "font-size": "16px",
             },
+            page_size=10,
         )
 
-    def update(self, this_next_month, this_next_day, option, daily_month):
-        debug_msg(f"OPTION: {option}")
-        monthly_transform = self.transform_pandas(monthly_data[option])
-        daily_transform = self.transform_pandas(daily_data[option], daily_month)
-
-        monthly_first = self.first_table(monthly_data, this_next_month)
-        daily_first = self.first_table(daily_data, this_next_day)
-
-        return monthly_first, daily_first, monthly_transform, daily_transform
-
 
 """ UPDATE HTML DROPDOWNS """
 
-
-@app.callback(
+# options of this / next month and day follow the eastern date, computed in the browser
+app.clientside_callback(
+    ClientsideFunction(namespace="seasonality", function_name="date_options"),
     Output("this_next_month", "options"),
     Output("this_next_day", "options"),
     Output("this_next_month", "value"),
     Output("this_next_day", "value"),
     Output("pick_month", "value"),
-    [
-        Input("this_next_month", "value"),
-        Input("this_next_day", "value"),
-        Input("pick_month", "value"),
-    ],
+    Input("this_next_month", "value"),
+    Input("this_next_day", "value"),
+    Input("pick_month", "value"),
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace="seasonality", function_name="figure"),
+    Output("spx_graph", "figure"),
+    Input("figure_json", "data"),
+)
+
+# symbols with shorter history than the longest window offer less lookbacks, shipped in the first data
+app.clientside_callback(
+    ClientsideFunction(namespace="seasonality", function_name="lookbacks"),
+    Output("slct", "options"),
+    Output("slct", "value"),
+    Input("first_data", "data"),
+    State("slct", "value"),
 )
-def update_date_dropdown(*inp):
-    outs = [
-        [time_eastern()[0], time_eastern()[2]],
-        [
-            f"{time_eastern()[0]}-{time_eastern()[1]}",
-            f"{time_eastern()[3]}-{time_eastern()[4]}",
-        ],
-    ]
-    if not inp[0]:
-        inp = [i[0] for i in outs]
-        inp.append(time_eastern()[0])
 
-    return *[[{"label": i, "value": i} for i in out] for out in outs], *inp
+# month / day picks, the highlight of today and the distribution columns need no server round trip
+app.clientside_callback(
+    ClientsideFunction(namespace="seasonality", function_name="tables"),
+    Output("monthly_first", "data"),
+    Output("monthly_first", "columns"),
+    Output("daily_first", "data"),
+    Output("daily_first", "columns"),
+    Output("table_monthly", "data"),
+    Output("table_monthly", "columns"),
+    Output("table_monthly", "style_data_conditional"),
+    Output("table_daily", "data"),
+    Output("table_daily", "columns"),
+    Output("table_daily", "style_data_conditional"),
+    Output("table_daily", "page_current"),
+    Input("window_data", "data"),
+    Input("first_data", "data"),
+    Input("this_next_month", "value"),
+    Input("this_next_day", "value"),
+    Input("pick_month", "value"),
+    Input("distribution", "value"),
+)
+
+
+def table_json(df, index_name, distribution=True):
+    """
+    Numeric table formatted for display, shipped to the browser as columns, calendar keys and rows
+    of values
+
+    :param index_name: Month or Day, see generate_graph.prettify_table
+    :param distribution: include the distribution columns
+    """
+    if not distribution:
+        df = df[["avg", "max", "max_year", "freq"]]
+    df = generate_graph.prettify_table(df, index_name)
+    return {
+        "columns": df.columns.tolist(),
+        "keys": df.index.tolist(),
+        "data": df.to_numpy().tolist(),
+    }
+
+
+def first_outputs(snap, symbol):
+    """Tables of all precomputed windows of the symbol, the first tables pick their month / day rows"""
+    key = ("first", snap.version, symbol)
+    res = response_cache.get(key)
+    if res is not None:
+        return res
+
+    version = response_cache.version
+    results = snap.symbols[symbol]
+    res = {
+        "windows": sorted(results.windows, reverse=True),
+        "max_years": results.max_years,
+        "distribution_columns": generate_graph.distribution_columns,
+        "monthly": {
+            y: table_json(df, "Month", False) for y, df in results.monthly_data.items()
+        },
+        "daily": {
+            y: table_json(df, "Day", False) for y, df in results.daily_data.items()
+        },
+    }
+    response_cache.put(key, res, version)
+    return res
+
+
+def graph_outputs(snap, years, symbol):
+    """Graph, tables and titles of the lookback"""
+    key = ("graph", snap.version, years, symbol)
+    res = response_cache.get(key)
+    if res is not None:
+        return res
+
+    version = response_cache.version
+    results = snap.symbols[symbol]
+    fig, monthly, daily = results.window(years)
+
+    table_title1 = (
+        f"Monthly {results.name} average gains table (over last {years} years)"
+    )
+    table_title2 = f"Daily {results.name} average gains table (over last {years} years)"
+
+    res = (
+        fig,
+        {"monthly": table_json(monthly, "Month"), "daily": table_json(daily, "Day")},
+        table_title1,
+        table_title2,
+    )
+    response_cache.put(key, res, version)
+    return res
+
+
+def scanner_outputs(snap, years, holding, symbol):
+    """Table and title of the best seasonal windows"""
+    key = ("scanner", snap.version, years, holding, symbol)
+    res = response_cache.get(key)
+    if res is not None:
+        return res
+
+    version = response_cache.version
+    results = snap.symbols[symbol]
+    if results.aggregates is None:
+        raise KeyError(symbol)
+    df = results.aggregates.scan(years, holding)
+
+    res = (
+        page.scanner_table(df),
+        f"Best {results.name} seasonal windows (over last {years} years)",
+    )
+    response_cache.put(key, res, version)
+    return res
 
 
 """ Connect Plotly and Dash """
 
 
 @app.callback(
-    [
-        Output("spx_graph", "figure"),
-        Output("monthly_first", "children"),
-        Output("daily_first", "children"),
-        Output("table_monthly", "children"),
-        Output("table_daily", "children"),
-        Output("monthly_title", "children"),
-        Output("daily_title", "children"),
-        Input(component_id="this_next_month", component_property="value"),
-        Input(component_id="this_next_day", component_property="value"),
-        Input(component_id="slct", component_property="value"),
-        Input(component_id="pick_month", component_property="value"),
-    ]
+    Output("figure_json", "data"),
+    Output("window_data", "data"),
+    Output("monthly_title", "children"),
+    Output("daily_title", "children"),
+    Output("first_data", "data"),
+    Output("first_version", "data"),
+    Output("table_scanner", "children"),
+    Output("scanner_title", "children"),
+    Input("slct", "value"),
+    Input("symbol", "value"),
+    Input("holding", "value"),
+    State("first_version", "data"),
 )
-def update_graph(*inp):
+@callback_time.time(callback="update_page")
+def update_page(years, symbol, holding, first_version):
+    """
+    The only server round trip of the page, ships the data of the lookback and of the symbol once
+    per data version, the tables are rendered from them in the browser
 
-    out = page.update(*inp)
+    :param first_version: [snapshot version, its creation time, symbol] of the first tables data the
+        browser has, versions restart at 1 when no persisted snapshot was loaded
+    """
 
-    table_title1 = f"Monthly SPX average gains table (over last {inp[2]} years)"
-    table_title2 = f"Daily SPX average gains table (over last {inp[2]} years)"
+    # the whole request is served from one snapshot
+    snap = current_snapshot()
+    if snap is None:
+        raise PreventUpdate
 
-    return fig[inp[2]], *out, table_title1, table_title2
+    try:
+        # the lookback picked for a longer history is clamped, the dropdown follows in the browser
+        max_years = snap.symbols[symbol].max_years
+        years = min(years or max_years, max_years)
+        if ctx.triggered_id == "holding":
+            graph = (no_update,) * 4
+        else:
+            graph = graph_outputs(snap, years, symbol)
+        token = [snap.version, snap.created, symbol]
+        if first_version == token:
+            first = no_update, no_update
+        else:
+            first = first_outputs(snap, symbol), token
+        if holding:
+            scanner = scanner_outputs(snap, years, holding, symbol)
+        else:
+            scanner = no_update, no_update
+    except KeyError:
+        raise PreventUpdate
 
+    return *graph, *first, *scanner
 
-def datas_thread():
-    global fig, monthly_data, daily_data, safe
 
-    fig = {}
-    monthly_data = {}
-    daily_data = {}
-    loop_time = 3600
-    safe = 0
+def publish(symbol, figs, monthly_data, daily_data, aggregates=None):
+    """Swaps the served snapshot for a new one with the given results of all windows of the symbol"""
+    global snapshot
 
-    while True:
-        st = time.time()
-        try:
-            for y in 10, 20, 30, 40, 50:
-                fig[y], monthly_data[y], daily_data[y] = generate_graph.main(y)
+    results = SymbolResults(
+        generate_graph.symbol_name(symbol), figs, monthly_data, daily_data, aggregates
+    )
+    if snapshot is None:
+        snapshot = Snapshot(1, {symbol: results})
+    else:
+        snapshot = snapshot.next(symbol, results)
+    response_cache.invalidate()
+    if serving_processes:
+        save_shared()
+
+
+def current_snapshot():
+    """Served snapshot, the serving processes follow the one published by the compute process"""
+    global snapshot
+    if shared is not None:
+        snap = shared.get()
+        if snap is not snapshot:
+            snapshot = snap
+            response_cache.invalidate()
+    return snapshot
+
+
+def save_snapshot():
+    try:
+        snapshot.save(snapshot_path)
+    except Exception:
+        traceback.print_exc()
+
+
+def save_shared():
+    try:
+        snapshot.save_shared(shared_snapshot_path)
+    except Exception:
+        traceback.print_exc()
+
+
+def write_atomic(path, content):
+    """Replaces the file at once, the other processes never read it half written"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
 
+
+def save_status(scheduler):
+    """Publishes the refreshes and the metrics of the compute process to the serving processes"""
+    try:
+        write_atomic(status_path, json.dumps(scheduler.status()).encode())
+    except Exception:
+        traceback.print_exc()
+    save_metrics()
+
+
+def refresh_status():
+    """Refreshes, serving processes read the status published by the compute process"""
+    if shared is None:
+        return scheduler.status()
+    return open_json(status_path)
+
+
+def save_metrics():
+    try:
+        write_atomic(metrics_path, pickle.dumps(registry.export()))
+    except Exception:
+        traceback.print_exc()
+
+
+def load_metrics():
+    """Metrics published by all the processes"""
+    res = []
+    for name in os.listdir(metrics_directory):
+        if not name.endswith(".pickle"):
+            continue
+        try:
+            with open(f"{metrics_directory}/{name}", "rb") as f:
+                res.append(pickle.load(f))
+        except FileNotFoundError:
+            pass
         except Exception:
             traceback.print_exc()
+    return res
+
+
+def next_refresh():
+    """Time of the next refresh, serving processes take the planned one (without the retries)"""
+    if shared is None:
+        return scheduler.next_run
+    return scheduler.planned_run(now_eastern())
 
-        safe = 1
 
-        time_took = time.time() - st
-        if time_took < loop_time:
-            time.sleep(loop_time - (time_took) + 0.1)
+@refresh_time.time()
+def refresh_data():
+    """
+    Refreshes the prices of all symbols in parallel and publishes every symbol as soon as it is done,
+    a slow or failed symbol doesnt hold up the others. Returns whether all symbols include the last session
+    """
+    global pool, safe
+
+    workers = min(len(symbols), config.get("workers", os.cpu_count()))
+    timeout = config.get("symbol_timeout", 900)
+    # first load of a symbol is full, after that only new bars are downloaded
+    if pool is None:
+        # fresh interpreters, forking this process could copy locks held by its serving threads
+        pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    pending = list(symbols)
+    # symbol and deadline of every submitted task. Tasks are submitted only to a free worker, so they
+    # start right away and a symbol queued behind a slow one doesnt use up its own time
+    running = {}
+    hung = []
+    complete = 0
+    while pending or running:
+        while pending and pool is not None and len(running) + len(hung) < workers:
+            symbol = pending.pop(0)
+            future = pool.submit(
+                generate_graph.refresh_symbol,
+                engines.get(symbol),
+                windows,
+                provider,
+                symbol,
+                config.get("figure_points"),
+            )
+            running[future] = symbol, time.monotonic() + timeout
+        if not running:
+            # all workers hung or the pool broke, the rest is retried with the next refresh
+            break
+
+        deadline = min(d for _, d in running.values())
+        done, _ = wait(
+            running,
+            timeout=max(deadline - time.monotonic(), 0),
+            return_when=FIRST_COMPLETED,
+        )
+        for future in done:
+            symbol, _ = running.pop(future)
+            try:
+                engine, results, worker_metrics = future.result()
+            except BrokenProcessPool:
+                # a worker died, the pool is recreated by the next refresh
+                traceback.print_exc()
+                stop_pool()
+                continue
+            except Exception:
+                # results couldnt be transferred from the worker
+                traceback.print_exc()
+                continue
+
+            registry.merge(worker_metrics)
+            if results is None:
+                debug_msg(f"Refresh of {symbol} failed")
+                continue
+
+            engines[symbol] = engine
+            publish(symbol, *results, engine.aggregates)
+            safe = 1
+            if engine.history.df.index[-1].date() >= last_completed_session():
+                complete += 1
+
+        for future, (symbol, deadline) in list(running.items()):
+            if not future.done() and time.monotonic() >= deadline:
+                debug_msg(f"Refresh of {symbol} timed out")
+                # the hung worker keeps its slot till the pool is stopped
+                del running[future]
+                hung.append(symbol)
+
+    if hung:
+        # only the hung workers are still busy, the pool is recreated by the next refresh
+        stop_pool()
+
+    if snapshot is not None:
+        save_snapshot()
+    return complete == len(symbols)
+
+
+def stop_pool():
+    """Shuts the symbols pool down, pending tasks are cancelled and still running workers terminated"""
+    global pool
+
+    if pool is None:
+        return
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+    pool = None
+
+
+# SpxWindows of every symbol, kept between refreshes for the incremental updates
+engines = {}
+pool = None
+provider = get_provider(
+    config.get("provider", "yfinance"), **config.get("provider_options", {})
+)
+scheduler = RefreshScheduler(
+    refresh_data,
+    delay_minutes=config.get("refresh_delay_minutes", 30),
+    max_backoff=config.get("refresh_max_backoff", 3600),
+    on_run=save_status if serving_processes else None,
+)
+
+
+@server.route("/status")
+def status():
+    snap = current_snapshot()
+    # serving processes report the refreshes of the compute process
+    return jsonify(
+        {
+            **refresh_status(),
+            "snapshot_version": snap.version if snap else None,
+        }
+    )
+
+
+def data_age_seconds():
+    snap = current_snapshot()
+    return time.time() - snap.created if snap else float("nan")
+
+
+# served data age and refresh failures are read when scraped
+data_age.set_function(data_age_seconds)
+refresh_failures.set_function(lambda: refresh_status().get("failures", 0))
+
+
+@server.route("/metrics")
+def metrics():
+    if metrics_path is None:
+        content = registry.render()
+    else:
+        # all the processes summed up, scrapes served by any process see the same non decreasing
+        # counters. Own metrics are published first, so they dont lag behind the previous scrape
+        save_metrics()
+        content = registry.render_merged(load_metrics())
+    return Response(content, mimetype="text/plain; version=0.0.4")
+
+
+def api_columns(df):
+    """
+    Columns of the statistics as compact JSON lists, gains rounded, dates as ISO strings, NaN and
+    infinite values as null
+    """
+    res = {"key": df.index.tolist()}
+    for column in df:
+        values = df[column]
+        if values.dtype.kind == "M":
+            res[column] = [
+                None if pd.isna(x) else x.strftime("%Y-%m-%d") for x in values
+            ]
+        else:
+            # float32 columns are widened first, rounding them would keep their binary noise
+            values = values.astype(float)
+            finite = np.isfinite(values.to_numpy())
+            values = values.round(6).astype(object)
+            res[column] = values.where(finite, None).tolist()
+    return res
+
+
+def api_response(key, build):
+    """
+    JSON response built once per snapshot version, revalidated by its content hash (ETag) and
+    cacheable till the next scheduled refresh
+
+    :param key: tuple identifying the request (endpoint and its arguments)
+    :param build: function snapshot -> JSON content, raises KeyError for unknown symbol or lookback
+    """
+    snap = current_snapshot()
+    if snap is None:
+        return jsonify({"error": "data are not ready yet"}), 503
+
+    key = ("api", snap.version, *key)
+    res = response_cache.get(key)
+    if res is None:
+        version = response_cache.version
+        try:
+            content = build(snap)
+        except KeyError as e:
+            return jsonify({"error": f"unknown {e.args[0]}"}), 404
+        body = json.dumps(content, separators=(",", ":"), allow_nan=False).encode()
+        res = body, hashlib.sha1(body).hexdigest()
+        response_cache.put(key, res, version)
+
+    body, etag = res
+    resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    resp.cache_control.public = True
+    next_run = next_refresh()
+    if next_run is None:
+        resp.cache_control.no_cache = True
+    else:
+        resp.cache_control.max_age = max(
+            int((next_run - now_eastern()).total_seconds()), 0
+        )
+    return resp.make_conditional(request)
+
+
+def api_arguments():
+    """
+    Symbol and lookback years of the API request, defaults are the first symbol and the longest
+    lookback of the symbol (None, resolved from the snapshot)
+    """
+    symbol = request.args.get("symbol", symbols[0])
+    years = request.args.get("years")
+    if years is None:
+        return symbol, None
+    if not years.isdecimal():
+        abort(make_response(jsonify({"error": f"invalid years {years}"}), 400))
+    return symbol, int(years)
+
+
+def api_window(snap, symbol, years):
+    """
+    Lookback years and raw seasonality, monthly and daily statistics of the lookback
+
+    :param years: lookback years, None for the longest lookback the symbol's history covers
+    """
+    results = snap.symbols.get(symbol)
+    if results is None or results.aggregates is None:
+        raise KeyError(f"symbol {symbol}")
+    if years is None:
+        years = results.max_years
+    try:
+        return years, results.aggregates.window(years)
+    except KeyError:
+        raise KeyError(f"lookback {years}")
+
+
+@server.route("/api/symbols")
+def api_symbols():
+    def build(snap):
+        return {
+            "version": snap.version,
+            "created": snap.created,
+            "windows": windows,
+            "symbols": [
+                {
+                    "symbol": symbol,
+                    "name": results.name,
+                    "max_years": results.max_years,
+                }
+                for symbol, results in snap.symbols.items()
+            ],
+        }
+
+    return api_response(("symbols",), build)
+
+
+@server.route("/api/seasonality")
+def api_seasonality():
+    symbol, years = api_arguments()
+
+    def build(snap):
+        lookback, stats = api_window(snap, symbol, years)
+        seasonality = stats[0]
+        return {
+            "symbol": symbol,
+            "years": lookback,
+            "version": snap.version,
+            **api_columns(seasonality.to_frame()),
+        }
+
+    return api_response(("seasonality", symbol, years), build)
+
+
+@server.route("/api/monthly")
+def api_monthly():
+    symbol, years = api_arguments()
+
+    def build(snap):
+        lookback, stats = api_window(snap, symbol, years)
+        monthly = stats[1]
+        return {
+            "symbol": symbol,
+            "years": lookback,
+            "version": snap.version,
+            **api_columns(monthly),
+        }
+
+    return api_response(("monthly", symbol, years), build)
+
+
+@server.route("/api/daily")
+def api_daily():
+    symbol, years = api_arguments()
+    month = request.args.get("month")
+    if month is not None:
+        if month.capitalize() in months:
+            month = months.index(month.capitalize()) + 1
+        elif month.isdigit() and 1 <= int(month) <= 12:
+            month = int(month)
         else:
-            print(f"Update Datas loop took too long: {round(time_took, 2)}s")
+            return jsonify({"error": f"invalid month {month}"}), 400
+
+    def build(snap):
+        lookback, stats = api_window(snap, symbol, years)
+        daily = stats[2]
+        if month is not None:
+            daily = daily[daily.index // 100 == month]
+        return {
+            "symbol": symbol,
+            "years": lookback,
+            "month": month,
+            "version": snap.version,
+            **api_columns(daily),
+        }
+
+    return api_response(("daily", symbol, years, month), build)
+
+
+def datas_thread():
+    scheduler.run()
+
+
+def metrics_thread(interval=5):
+    """Publishes the metrics of the serving process, so scrapes served by the others see them too"""
+    while True:
+        time.sleep(interval)
+        save_metrics()
+
+
+def serve_worker(sock, slot):
+    """
+    Serving process, serves on the shared socket from the snapshot published by the compute process
+
+    :param slot: index of the serving process, a restarted one takes the slot of the one it replaces
+    """
+    global shared, page, metrics_path
+
+    shared = SharedSnapshotReader(shared_snapshot_path)
+    metrics_path = f"{metrics_directory}/serving-{slot}.pickle"
+    # counters continue from the last ones published by the replaced process
+    try:
+        with open(metrics_path, "rb") as f:
+            registry.merge(pickle.load(f))
+    except FileNotFoundError:
+        pass
+    threading.Thread(target=metrics_thread, daemon=True).start()
+    page = Webpage()
+    compression.precompress(server)
+    serve(
+        app.server,
+        sockets=[sock],
+        url_scheme="http" if config["is_test"] else "https",
+    )
+
+
+def serve_processes(n):
+    """
+    Runs the refreshes in this process and serves the page from n processes sharing one listening
+    socket, so serving scales over the cores and doesnt compete with the refresh for the GIL.
+    Serving processes which died are started again
+    """
+    global metrics_path
+
+    if config["is_test"]:
+        address = ("127.0.0.1", 8050)
+    else:
+        address = (config["ip"], int(config["port"]))
+    sock = socket.create_server(address)
+    # metrics of the previous run are not continued
+    os.makedirs(metrics_directory, exist_ok=True)
+    for name in os.listdir(metrics_directory):
+        os.remove(f"{metrics_directory}/{name}")
+    metrics_path = f"{metrics_directory}/compute.pickle"
+    save_metrics()
+    # fresh interpreters, the compute process runs threads and the symbols pool
+    context = multiprocessing.get_context("spawn")
+
+    def start(slot):
+        worker = context.Process(target=serve_worker, args=(sock, slot), daemon=True)
+        worker.start()
+        return worker
+
+    workers = [start(slot) for slot in range(n)]
+    print(f"{get_time_in_sk()} serving from {n} processes at {address}")
+    threading.Thread(target=datas_thread, daemon=True).start()
+    while True:
+        time.sleep(5)
+        for i, worker in enumerate(workers):
+            if not worker.is_alive():
+                debug_msg(
+                    f"Serving process {worker.pid} exited with {worker.exitcode}, restarting"
+                )
+                workers[i] = start(i)
 
 
 if __name__ == "__main__":
@@ -373,8 +1015,17 @@ if __name__ == "__main__":
     if not os.path.exists(logs_directory):
         os.makedirs(logs_directory)
 
-    safe = 0
-    threading.Thread(target=datas_thread, daemon=True).start()
+    # warm start, serve the last persisted results while the first refresh runs
+    snapshot = Snapshot.load(snapshot_path)
+    safe = 1 if snapshot else 0
+    if snapshot:
+        debug_msg(f"Loaded snapshot version {snapshot.version}")
 
-    page = Webpage()
-    page.start_server()
+    if serving_processes:
+        if snapshot:
+            save_shared()
+        serve_processes(serving_processes)
+    else:
+        threading.Thread(target=datas_thread, daemon=True).start()
+        page = Webpage()
+        page.start_server()
@@ -0,0 +1,109 @@
+import datetime
+from functools import lru_cache
+
+import pytz
+
+EASTERN = pytz.timezone("US/Eastern")
+MARKET_CLOSE = datetime.time(16, 0)
+
+
+def easter(year):
+    """Easter sunday (anonymous gregorian algorithm)"""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return datetime.date(year, month, day + 1)
+
+
+def nth_weekday(year, month, weekday, n):
+    """n-th weekday (0 = monday) of the month, n = -1 for the last one"""
+    if n > 0:
+        day = datetime.date(year, month, 1)
+        day += datetime.timedelta(days=(weekday - day.weekday()) % 7)
+        return day + datetime.timedelta(weeks=n - 1)
+
+    day = datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(
+        days=1
+    )
+    return day - datetime.timedelta(days=(day.weekday() - weekday) % 7)
+
+
+def observed(day):
+    """Holiday on saturday is observed on friday, on sunday on monday"""
+    if day.weekday() == 5:
+        return day - datetime.timedelta(days=1)
+    if day.weekday() == 6:
+        return day + datetime.timedelta(days=1)
+    return day
+
+
+@lru_cache(maxsize=None)
+def holidays(year):
+    """
+    Regular NYSE holidays of the year. One-off closures (national days of mourning, hurricanes) are
+    not included, a refresh on such day only finds no new bar
+    """
+    days = {
+        nth_weekday(year, 2, 0, 3),  # Washington's birthday
+        easter(year) - datetime.timedelta(days=2),  # good friday
+        nth_weekday(year, 5, 0, -1),  # memorial day
+        observed(datetime.date(year, 7, 4)),
+        nth_weekday(year, 9, 0, 1),  # labor day
+        nth_weekday(year, 11, 3, 4),  # thanksgiving
+        observed(datetime.date(year, 12, 25)),
+    }
+    # new year on saturday isnt moved to friday of the previous year
+    new_year = datetime.date(year, 1, 1)
+    if new_year.weekday() != 5:
+        days.add(observed(new_year))
+    if year >= 1998:
+        days.add(nth_weekday(year, 1, 0, 3))  # martin luther king day
+    if year >= 2022:
+        days.add(observed(datetime.date(year, 6, 19)))  # juneteenth
+
+    return days
+
+
+def is_trading_day(day):
+    return day.weekday() < 5 and day not in holidays(day.year)
+
+
+def next_trading_day(day):
+    """First trading day after the given day"""
+    day += datetime.timedelta(days=1)
+    while not is_trading_day(day):
+        day += datetime.timedelta(days=1)
+    return day
+
+
+def previous_trading_day(day):
+    """Last trading day before the given day"""
+    day -= datetime.timedelta(days=1)
+    while not is_trading_day(day):
+        day -= datetime.timedelta(days=1)
+    return day
+
+
+def session_close(day):
+    """Closing time of the session as aware eastern datetime"""
+    return EASTERN.localize(datetime.datetime.combine(day, MARKET_CLOSE))
+
+
+def now_eastern():
+    return datetime.datetime.now(tz=pytz.utc).astimezone(EASTERN)
+
+
+def last_completed_session(now=None):
+    """Date of the last session that already closed"""
+    now = now or now_eastern()
+    day = now.date()
+    if is_trading_day(day) and now >= session_close(day):
+        return day
+    return previous_trading_day(day)
@@ -0,0 +1,252 @@
+import copy
+import math
+import time
+import threading
+from contextlib import ContextDecorator
+
+# default latency buckets in seconds, same as the prometheus clients use
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_value(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def escape(value):
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+
+class Metric:
+    """Base of the metrics, values are kept per sorted tuple of label (name, value) pairs"""
+
+    type = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.register(self)
+
+    @staticmethod
+    def key(labels):
+        return tuple(sorted(labels.items()))
+
+    def samples(self):
+        """Returns list of (name suffix, labels, value)"""
+        with self.lock:
+            return [("", key, value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{format_labels(labels)} {format_value(value)}"
+            )
+        return lines
+
+    def export(self):
+        with self.lock:
+            return dict(self.values)
+
+    def merge(self, values):
+        """Adds values exported by another process"""
+        raise NotImplementedError
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def merge(self, values):
+        for key, amount in values.items():
+            self.inc(amount, **dict(key))
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Gauge set directly or read from a function at scrape time"""
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, function=None):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def merge(self, values):
+        for key, value in values.items():
+            self.set(value, **dict(key))
+
+    def samples(self):
+        if self.function is not None:
+            return [("", (), self.function())]
+        return super().samples()
+
+
+class Timer(ContextDecorator):
+    """Observes the duration of the block (or of every call of the decorated function)"""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.starts = threading.local()
+
+    def __enter__(self):
+        self.starts.__dict__.setdefault("stack", []).append(time.perf_counter())
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.starts.stack.pop()
+        self.histogram.observe(duration, **self.labels)
+        return False
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def export(self):
+        with self.lock:
+            return {
+                key: (list(counts), total)
+                for key, (counts, total) in self.values.items()
+            }
+
+    def merge(self, values):
+        with self.lock:
+            for key, (counts, total) in values.items():
+                own_counts, own_total = self.values.get(
+                    key, ([0] * len(self.buckets), 0.0)
+                )
+                self.values[key] = (
+                    [a + b for a, b in zip(own_counts, counts)],
+                    own_total + total,
+                )
+
+    def time(self, **labels):
+        """Context manager and decorator timing the code under the given labels"""
+        return Timer(self, labels)
+
+    def samples(self):
+        res = []
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                for bound, count in zip(self.buckets, counts):
+                    res.append(("_bucket", key + (("le", format_value(bound)),), count))
+                res.append(("_count", key, counts[-1]))
+                res.append(("_sum", key, total))
+        return res
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def export(self):
+        """Values of all metrics, to be merged to the registry of another process"""
+        return {metric.name: metric.export() for metric in self.metrics}
+
+    def merge(self, exported):
+        for metric in self.metrics:
+            if exported.get(metric.name):
+                metric.merge(exported[metric.name])
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+
+    def render(self):
+        """All metrics in the prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def render_merged(self, exported):
+        """
+        Renders the values exported by several processes merged (counters and histograms summed up),
+        the values of this registry are left as they are
+
+        :param exported: list of Registry.export of the processes
+        """
+        lines = []
+        for metric in self.metrics:
+            merged = copy.copy(metric)
+            merged.values = {}
+            merged.lock = threading.Lock()
+            for values in exported:
+                if values.get(metric.name):
+                    merged.merge(values[metric.name])
+            lines.extend(merged.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_time = Histogram(
+    "spx_stage_seconds",
+    "Duration of the data pipeline stages",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120),
+)
+refresh_time = Histogram(
+    "spx_refresh_seconds",
+    "Duration of the whole data refresh",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+callback_time = Histogram("spx_callback_seconds", "Duration of the Dash callbacks")
+download_failures = Counter(
+    "spx_download_failures_total", "Failed downloads of market data"
+)
+backup_fallbacks = Counter(
+    "spx_backup_fallbacks_total", "Prices loaded from the local backup instead"
+)
+refresh_failures = Gauge(
+    "spx_refresh_consecutive_failures", "Failed refreshes since the last successful one"
+)
+data_age = Gauge(
+    "spx_data_age_seconds", "Seconds since the currently served snapshot was built"
+)
@@ -0,0 +1,137 @@
+import os
+import numpy as np
+import pandas as pd
+from help_functions import *
+
+SCHEMA_VERSION = 1
+
+
+class PriceStore:
+    """
+    Binary columnar price store. Dates and every column are fixed width arrays in their own files,
+    reads memory map them and slice the requested date range without parsing the whole file.
+    meta.json holds the schema version, columns and the number of committed rows, rows are visible
+    only after meta.json is atomically replaced, so appends and full rewrites are atomic.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.meta_path = os.path.join(path, "meta.json")
+
+    def file(self, name, generation):
+        return os.path.join(self.path, f"{name}.{generation}.bin")
+
+    def read_meta(self):
+        """Returns meta of the store, None if it doesnt exist or has a different schema version"""
+        meta = open_json(self.meta_path)
+        if meta.get("version") != SCHEMA_VERSION:
+            return None
+        return meta
+
+    def write_meta(self, meta):
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.meta_path)
+
+    def write_arrays(self, meta, df, mode):
+        arrays = {"date": df.index.to_numpy(dtype="datetime64[ns]").view(np.int64)}
+        for i, column in enumerate(meta["columns"]):
+            arrays[str(i)] = df[column].to_numpy(dtype=meta["dtypes"][i])
+
+        for name, array in arrays.items():
+            path = self.file(name, meta["generation"])
+            if mode == "ab":
+                # drop a possibly torn previous append
+                os.truncate(path, meta["rows"] * array.dtype.itemsize)
+            with open(path, mode) as f:
+                f.write(np.ascontiguousarray(array).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+    def write(self, df):
+        """Rewrites the whole store with the given prices (sorted by date)"""
+        os.makedirs(self.path, exist_ok=True)
+        old_meta = self.read_meta()
+        meta = {
+            "version": SCHEMA_VERSION,
+            "generation": old_meta["generation"] + 1 if old_meta else 0,
+            "columns": list(df.columns),
+            "dtypes": [df[column].dtype.str for column in df.columns],
+            "rows": 0,
+        }
+        self.write_arrays(meta, df, "wb")
+        meta["rows"] = len(df)
+        self.write_meta(meta)
+
+        # files of older generations arent referenced anymore
+        for name in os.listdir(self.path):
+            if name.endswith(".bin") and name.split(".")[-2] != f"{meta['generation']}":
+                os.remove(os.path.join(self.path, name))
+
+    def append(self, df):
+        """Appends bars newer than the last stored date"""
+        meta = self.read_meta()
+        if not meta or not meta["rows"]:
+            self.write(df)
+            return
+
+        if list(df.columns) != meta["columns"]:
+            raise ValueError(f"Columns {list(df.columns)} dont match the price store")
+
+        df = df[df.index > self.last_date(meta)]
+        if not len(df):
+            return
+
+        self.write_arrays(meta, df, "ab")
+        meta["rows"] += len(df)
+        self.write_meta(meta)
+
+    def dates(self, meta):
+        return np.memmap(
+            self.file("date", meta["generation"]),
+            dtype=np.int64,
+            mode="r",
+            shape=(meta["rows"],),
+        ).view("datetime64[ns]")
+
+    def last_date(self, meta=None):
+        meta = meta or self.read_meta()
+        if not meta or not meta["rows"]:
+            return None
+        return pd.Timestamp(self.dates(meta)[-1])
+
+    def read(self, start=None, end=None):
+        """
+        Returns stored prices between start and end (both included), None if the store doesnt exist
+
+        :param start: first date, from the beginning when not set
+        :param end: last date, till the end when not set
+        """
+        meta = self.read_meta()
+        if not meta or not meta["rows"]:
+            return None
+
+        dates = self.dates(meta)
+        lo = dates.searchsorted(np.datetime64(start, "ns")) if start else 0
+        hi = (
+            dates.searchsorted(np.datetime64(end, "ns"), side="right")
+            if end
+            else len(dates)
+        )
+
+        data = {}
+        for i, column in enumerate(meta["columns"]):
+            values = np.memmap(
+                self.file(str(i), meta["generation"]),
+                dtype=meta["dtypes"][i],
+                mode="r",
+                shape=(meta["rows"],),
+            )
+            data[column] = np.array(values[lo:hi])
+
+        return pd.DataFrame(
+            data, index=pd.DatetimeIndex(np.array(dates[lo:hi]), name="Date")
+        )
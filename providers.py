@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+import yfinance as yf
+from help_functions import *
+from price_store import PriceStore
+from market_calendar import holidays
+
+PRICE_COLUMNS = ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
+
+
+class DataProvider:
+    """
+    Source of daily OHLC bars indexed by Date with the yahoo columns, end of the range is exclusive.
+
+    supports_range: provider can fetch only the requested date range, otherwise the whole history is
+    fetched and sliced
+    live: real market data, only those are stored to the backup
+    """
+
+    name = "base"
+    supports_range = True
+    live = False
+
+    def download(self, symbol, start, end):
+        raise NotImplementedError
+
+    def get_prices(self, symbol, start, end):
+        """Bars of the symbol between start and end (exclusive)"""
+        if self.supports_range:
+            return self.download(symbol, start, end)
+
+        res = self.download(symbol, None, None)
+        return res[(res.index >= start) & (res.index < end)]
+
+
+class YFinanceProvider(DataProvider):
+    name = "yfinance"
+    live = True
+
+    def download(self, symbol, start, end):
+        return yf.download(symbol, start=start, end=end, progress=False)
+
+
+class StoreProvider(DataProvider):
+    """Serves prices from the local price stores (logs/<symbol>.prices), no network needed"""
+
+    name = "store"
+
+    def __init__(self, directory="logs"):
+        self.directory = directory
+
+    def download(self, symbol, start, end):
+        res = PriceStore(f"{self.directory}/{symbol}.prices").read(start, end)
+        if res is None:
+            return pd.DataFrame(columns=PRICE_COLUMNS)
+        return res[res.index < end] if end else res
+
+
+class SyntheticProvider(DataProvider):
+    """
+    Offline provider. Replays recorded bars (CSV with Date column) or generates a deterministic random
+    walk on NYSE trading days, every symbol has its own series and overlapping ranges always match
+    """
+
+    name = "synthetic"
+
+    def __init__(
+        self,
+        recorded=None,
+        seed=0,
+        origin="1927-12-30",
+        start_price=17.66,
+        drift=0.0003,
+        volatility=0.011,
+    ):
+        """
+        :param recorded: CSV file (or DataFrame) with recorded bars to replay instead of generated ones
+        :param seed: seed of the generated series, combined with the symbol
+        :param origin: first date of the generated series
+        :param start_price: first close of the generated series
+        :param drift: mean daily log return
+        :param volatility: std of daily log returns
+        """
+        self.seed = seed
+        self.origin = pd.Timestamp(origin)
+        self.start_price = start_price
+        self.drift = drift
+        self.volatility = volatility
+        self.series = {}
+
+        self.recorded = recorded
+        if isinstance(recorded, str):
+            self.recorded = pd.read_csv(recorded, index_col="Date", parse_dates=True)
+        if self.recorded is not None:
+            # recorded bars are replayed as a whole
+            self.supports_range = False
+
+    def generate(self, symbol, end):
+        """Generated bars from the origin till end, extended lazily and cached per symbol"""
+        end = pd.Timestamp(end)
+        if symbol in self.series and self.series[symbol][0] >= end:
+            return self.series[symbol][1]
+
+        last = max(end, pd.Timestamp.now().normalize() + pd.Timedelta(days=1))
+        days = pd.bdate_range(
+            self.origin,
+            last,
+            freq="C",
+            holidays=[
+                day
+                for year in range(self.origin.year, last.year + 1)
+                for day in holidays(year)
+            ],
+            name="Date",
+        )
+        # every field has its own stream, so a longer series keeps the same beginning
+        rng = lambda field: np.random.default_rng([self.seed, field, *symbol.encode()])
+        returns = rng(0).normal(self.drift, self.volatility, len(days))
+        close = self.start_price * np.exp(np.cumsum(returns))
+        open_ = close * np.exp(-returns * rng(1).uniform(0, 1, len(days)))
+        spread = np.abs(rng(2).normal(0, self.volatility / 2, len(days)))
+        res = pd.DataFrame(
+            {
+                "Open": open_,
+                "High": np.maximum(open_, close) * (1 + spread),
+                "Low": np.minimum(open_, close) * (1 - spread),
+                "Close": close,
+                "Adj Close": close,
+                "Volume": rng(3).integers(1_000_000, 5_000_000, len(days)),
+            },
+            index=days,
+        )
+        self.series[symbol] = (last, res)
+        return res
+
+    def download(self, symbol, start, end):
+        if self.recorded is not None:
+            return self.recorded.copy()
+
+        res = self.generate(symbol, end)
+        return res[(res.index >= start) & (res.index < end)].copy()
+
+
+providers = {
+    YFinanceProvider.name: YFinanceProvider,
+    StoreProvider.name: StoreProvider,
+    SyntheticProvider.name: SyntheticProvider,
+}
+
+
+def get_provider(name="yfinance", **options):
+    """Creates provider by its name (yfinance, store, synthetic) with the given options"""
+    return providers[name](**options)
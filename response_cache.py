@@ -0,0 +1,42 @@
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache of fully built callback outputs. Every publish of new data bumps the version and
+    drops all entries at once, outputs built from older data are never stored
+    """
+
+    def __init__(self, max_size=512):
+        self.max_size = max_size
+        self.version = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Returns cached output or None"""
+        with self.lock:
+            res = self.items.get(key)
+            if res is not None:
+                self.items.move_to_end(key)
+            return res
+
+    def put(self, key, value, version):
+        """
+        Stores the output unless new data were published meanwhile
+
+        :param version: cache version read before the output was built
+        """
+        with self.lock:
+            if version != self.version:
+                return
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def invalidate(self):
+        with self.lock:
+            self.version += 1
+            self.items = OrderedDict()
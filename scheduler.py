@@ -0,0 +1,103 @@
+import random
+import datetime
+from help_functions import *
+from market_calendar import (
+    is_trading_day,
+    next_trading_day,
+    now_eastern,
+    session_close,
+)
+
+
+class RefreshScheduler:
+    """
+    Runs the refresh shortly after the US close on trading days, non trading days are skipped.
+    Failed refreshes are retried with bounded exponential backoff with jitter
+    """
+
+    def __init__(
+        self,
+        refresh,
+        delay_minutes=30,
+        min_backoff=60,
+        max_backoff=3600,
+        jitter=0.2,
+        on_run=None,
+    ):
+        """
+        :param refresh: callable running the refresh, returns False (or raises) when it has to be retried
+        :param delay_minutes: how long after the close the refresh runs
+        :param min_backoff: seconds before the first retry, doubles with every failure
+        :param max_backoff: max seconds between retries
+        :param jitter: relative random deviation of the retry delay
+        :param on_run: optional callable called with the scheduler after every run
+        """
+        self.refresh = refresh
+        self.delay = datetime.timedelta(minutes=delay_minutes)
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.on_run = on_run
+
+        self.next_run = None
+        self.last_run = None
+        self.last_outcome = None
+        self.last_duration = None
+        self.failures = 0
+
+    def planned_run(self, now):
+        """First refresh time (close + delay of a trading day) after now"""
+        day = now.date()
+        if not is_trading_day(day) or now >= session_close(day) + self.delay:
+            day = next_trading_day(day)
+        return session_close(day) + self.delay
+
+    def backoff(self):
+        delay = min(self.max_backoff, self.min_backoff * 2 ** (self.failures - 1))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def run_once(self):
+        """Runs the refresh and plans the next run"""
+        st = time.time()
+        self.last_run = now_eastern()
+        try:
+            done = self.refresh()
+        except Exception:
+            traceback.print_exc()
+            done = False
+        self.last_duration = time_diff(st, time.time())
+
+        now = now_eastern()
+        planned = self.planned_run(now)
+        if done:
+            self.failures = 0
+            self.last_outcome = "ok"
+            self.next_run = planned
+        else:
+            self.failures += 1
+            self.last_outcome = "failed"
+            retry = now + datetime.timedelta(seconds=self.backoff())
+            self.next_run = min(retry, planned)
+
+        debug_msg(
+            f"Refresh {self.last_outcome} in {self.last_duration}s, next run {self.next_run}"
+        )
+        if self.on_run is not None:
+            self.on_run(self)
+
+    def run(self):
+        """Refreshes right away and then forever according to the plan"""
+        while True:
+            self.run_once()
+            wait = (self.next_run - now_eastern()).total_seconds()
+            time.sleep(max(wait, 0))
+
+    def status(self):
+        iso = lambda tm: tm.isoformat() if tm else None
+        return {
+            "next_run": iso(self.next_run),
+            "last_run": iso(self.last_run),
+            "last_outcome": self.last_outcome,
+            "last_duration": self.last_duration,
+            "failures": self.failures,
+        }
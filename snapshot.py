@@ -0,0 +1,244 @@
+import io
+import os
+import copyreg
+import mmap
+import time
+import pickle
+import struct
+import threading
+import traceback
+from types import MappingProxyType
+
+# format of the persisted snapshot, snapshots of other formats are not loaded
+SNAPSHOT_FORMAT = 3
+# shared snapshot file: header (magic, format, version, pickle size, number of arrays), offset and size
+# of every array, the pickle and the arrays aligned after it
+SHARED_MAGIC = b"SPXSNAP\0"
+SHARED_HEADER = struct.Struct("<8sIQQI")
+SHARED_ALIGN = 64
+
+
+class SharedPickler(pickle.Pickler):
+    """
+    Pickles objects defining shared_state() by that state instead of their (smaller) persisted one,
+    so nothing has to be recalculated by the processes attaching the shared snapshot
+    """
+
+    def reducer_override(self, obj):
+        shared_state = getattr(type(obj), "shared_state", None)
+        if shared_state is None or isinstance(obj, type):
+            return NotImplemented
+        return copyreg.__newobj__, (type(obj),), shared_state(obj)
+
+
+class SymbolResults:
+    """Immutable results of all the windows of one symbol"""
+
+    __slots__ = (
+        "name",
+        "windows",
+        "figs",
+        "monthly_data",
+        "daily_data",
+        "aggregates",
+    )
+
+    def __init__(self, name, figs, monthly_data, daily_data, aggregates=None):
+        """
+        :param name: display name of the symbol
+        :param monthly_data: dict years: numeric monthly table (generate_graph.compact_table)
+        :param daily_data: dict years: numeric daily table
+        :param aggregates: SpxAggregates the results of the other lookbacks are built from, optional
+        """
+        set_attr = super().__setattr__
+        set_attr("name", name)
+        set_attr("windows", tuple(sorted(figs)))
+        set_attr("figs", MappingProxyType(dict(figs)))
+        set_attr("monthly_data", MappingProxyType(dict(monthly_data)))
+        set_attr("daily_data", MappingProxyType(dict(daily_data)))
+        set_attr("aggregates", aggregates)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SymbolResults are immutable")
+
+    def __reduce__(self):
+        return SymbolResults, (
+            self.name,
+            dict(self.figs),
+            dict(self.monthly_data),
+            dict(self.daily_data),
+            self.aggregates,
+        )
+
+    @property
+    def max_years(self):
+        """Longest lookback of the symbol, shorter than the longest window for symbols with short history"""
+        if self.aggregates is not None:
+            return self.aggregates.max_years
+        return self.windows[-1]
+
+    def window(self, years):
+        """
+        Graph (JSON, see generate_graph.figure_json), numeric monthly and daily table of the lookback,
+        built from the aggregates if not precomputed
+        """
+        if years in self.figs:
+            return self.figs[years], self.monthly_data[years], self.daily_data[years]
+        if self.aggregates is None:
+            raise KeyError(years)
+        return self.aggregates.results(years)
+
+
+class Snapshot:
+    """
+    Immutable results of all the symbols. It is built off to the side and published by a single
+    reference swap, readers take the reference once per request and see one consistent version
+    """
+
+    __slots__ = ("version", "created", "symbols")
+
+    def __init__(self, version, symbols, created=None):
+        """
+        :param symbols: dict symbol: SymbolResults
+        """
+        set_attr = super().__setattr__
+        set_attr("version", version)
+        set_attr("created", created or time.time())
+        set_attr("symbols", MappingProxyType(dict(symbols)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Snapshot is immutable")
+
+    def next(self, symbol, results):
+        """Returns the following version with new results of the symbol, other symbols are kept"""
+        return Snapshot(self.version + 1, {**self.symbols, symbol: results})
+
+    def save(self, path):
+        """Persists the snapshot (atomically replaces the file) so the next start can serve it right away"""
+        content = {
+            "format": SNAPSHOT_FORMAT,
+            "version": self.version,
+            "created": self.created,
+            "symbols": dict(self.symbols),
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(content, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def save_shared(self, path):
+        """
+        Writes the snapshot for the serving processes. Arrays are stored out of the pickle (protocol 5)
+        and aligned, so attach uses them straight from the memory mapped file without copying
+        """
+        arrays = []
+        f = io.BytesIO()
+        SharedPickler(f, protocol=5, buffer_callback=arrays.append).dump(
+            {
+                "version": self.version,
+                "created": self.created,
+                "symbols": dict(self.symbols),
+            }
+        )
+        arrays = [array.raw() for array in arrays]
+
+        offsets = []
+        offset = SHARED_HEADER.size + 16 * len(arrays) + f.tell()
+        for array in arrays:
+            offset += -offset % SHARED_ALIGN
+            offsets += [offset, array.nbytes]
+            offset += array.nbytes
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as out:
+            out.write(
+                SHARED_HEADER.pack(
+                    SHARED_MAGIC, SNAPSHOT_FORMAT, self.version, f.tell(), len(arrays)
+                )
+            )
+            out.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+            out.write(f.getbuffer())
+            for array, offset in zip(arrays, offsets[::2]):
+                out.write(b"\0" * (offset - out.tell()))
+                out.write(array)
+        # processes attached to the previous file keep it mapped till they move on
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def attach(path):
+        """
+        Maps the snapshot written by save_shared read only, its arrays stay in the pages shared by all
+        the processes. Returns None if the file has another format
+        """
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, file_format, _, size, n_arrays = SHARED_HEADER.unpack_from(mapped)
+        if magic != SHARED_MAGIC or file_format != SNAPSHOT_FORMAT:
+            return None
+
+        offsets = struct.unpack_from(f"<{2 * n_arrays}Q", mapped, SHARED_HEADER.size)
+        view = memoryview(mapped)
+        arrays = [
+            view[offset : offset + nbytes]
+            for offset, nbytes in zip(offsets[::2], offsets[1::2])
+        ]
+        start = SHARED_HEADER.size + 16 * n_arrays
+        content = pickle.loads(view[start : start + size], buffers=arrays)
+        return Snapshot(**content)
+
+    @staticmethod
+    def load(path):
+        """Returns persisted snapshot or None if there is none (or it cant be read)"""
+        try:
+            with open(path, "rb") as f:
+                content = pickle.load(f)
+            if content.pop("format", 1) != SNAPSHOT_FORMAT:
+                return None
+            return Snapshot(**content)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            traceback.print_exc()
+            return None
+
+
+class SharedSnapshotReader:
+    """
+    Snapshot of a serving process, follows the shared snapshot file published by the compute process.
+    The file is checked at most once per interval, a new one is attached when it was replaced
+    """
+
+    def __init__(self, path, interval=1):
+        """
+        :param path: shared snapshot file, see Snapshot.save_shared
+        :param interval: seconds between the checks of the file
+        """
+        self.path = path
+        self.interval = interval
+        self.snapshot = None
+        self.stamp = None
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        """Newest published snapshot, None before the first one"""
+        if time.monotonic() - self.checked < self.interval:
+            return self.snapshot
+
+        with self.lock:
+            if time.monotonic() - self.checked < self.interval:
+                return self.snapshot
+            self.checked = time.monotonic()
+            try:
+                st = os.stat(self.path)
+                stamp = st.st_ino, st.st_mtime_ns, st.st_size
+                if stamp != self.stamp:
+                    snapshot = Snapshot.attach(self.path)
+                    if snapshot is not None:
+                        self.snapshot = snapshot
+                    self.stamp = stamp
+            except FileNotFoundError:
+                pass
+            except Exception:
+                traceback.print_exc()
+        return self.snapshot
@@ -0,0 +1,131 @@
+import os
+import sys
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate_graph
+import market_calendar
+from generate_graph import SpxWindows, get_window_range
+from providers import SyntheticProvider
+
+# not a symbol with a backup price store in logs/
+SYMBOL = "TEST"
+
+
+@pytest.fixture
+def today(monkeypatch):
+    """Sets the current date, the time is in the evening after the close"""
+    state = {}
+
+    def set_today(day):
+        state["now"] = pytz.timezone("US/Eastern").localize(
+            datetime.datetime.combine(day, datetime.time(18))
+        )
+
+    monkeypatch.setattr(
+        generate_graph,
+        "last_completed_session",
+        lambda now=None: market_calendar.last_completed_session(now or state["now"]),
+    )
+    monkeypatch.setattr(generate_graph, "time_eastern", lambda raw=False: state["now"])
+    return set_today
+
+
+def reference_stats(values, keys):
+    """Statistics of the groups by a plain pandas groupby of the rows"""
+    values = values.astype(float)
+    grouped = values.groupby(keys)
+    return pd.DataFrame(
+        {
+            "avg": grouped.mean(),
+            "max": grouped.max(),
+            "max_date": grouped.idxmax(),
+            "freq": (values > 0).groupby(keys).mean() * 100,
+            "median": grouped.median(),
+            "q1": grouped.quantile(0.25),
+            "q3": grouped.quantile(0.75),
+            "std": grouped.std(),
+            "min": grouped.min(),
+            "min_date": grouped.idxmin(),
+            "downside": np.sqrt((values.clip(upper=0) ** 2).groupby(keys).mean()),
+        }
+    )
+
+
+def assert_same_stats(stats, expected):
+    assert stats.index.tolist() == expected.index.tolist()
+    assert stats.columns.tolist() == expected.columns.tolist()
+    for column in expected:
+        if column.endswith("_date"):
+            np.testing.assert_array_equal(stats[column], expected[column])
+        else:
+            np.testing.assert_allclose(
+                stats[column].astype(float), expected[column], rtol=1e-9, atol=1e-12
+            )
+
+
+def assert_window(engine, years):
+    """window(years) of the aggregates against the rows of the lookback"""
+    past, _ = get_window_range(years, engine.aggregates.nw)
+    df = engine.history.df
+    rows = df[df.index >= past]
+    seasonality, monthly, daily = engine.aggregates.window(years)
+
+    expected = rows["increase"].astype(float).groupby(rows["month_day"]).mean()
+    assert seasonality.index.tolist() == expected.index.tolist()
+    np.testing.assert_allclose(seasonality, expected, rtol=1e-9, atol=1e-12)
+
+    month_ends = rows[rows["last_month_day"] == 1]
+    assert_same_stats(
+        monthly,
+        reference_stats(
+            month_ends["monthly_increase"],
+            month_ends["month_day"].to_numpy() // 100,
+        ),
+    )
+    assert_same_stats(
+        daily, reference_stats(rows["monthly_increase"], rows["month_day"].to_numpy())
+    )
+
+
+@pytest.mark.parametrize(
+    "day",
+    [
+        # window starts in the middle of a year and a month
+        datetime.date(2024, 7, 17),
+        # window starts in January
+        datetime.date(2024, 1, 10),
+    ],
+)
+def test_any_lookback(today, day):
+    today(day)
+    engine = SpxWindows([12], SyntheticProvider(seed=7), SYMBOL)
+    assert engine.aggregates.max_years == 12
+
+    for years in range(1, 13):
+        assert_window(engine, years)
+
+
+def test_short_history(today):
+    # history starts within the longest window, its first year is partial
+    today(datetime.date(2024, 7, 17))
+    engine = SpxWindows([12], SyntheticProvider(seed=7, origin="2016-09-14"), SYMBOL)
+    assert engine.aggregates.max_years == 7
+
+    for years in range(1, 8):
+        assert_window(engine, years)
+
+
+def test_lookback_out_of_range(today):
+    today(datetime.date(2024, 7, 17))
+    engine = SpxWindows([5], SyntheticProvider(seed=7), SYMBOL)
+
+    for years in (0, 6):
+        with pytest.raises(KeyError):
+            engine.aggregates.window(years)
@@ -0,0 +1,101 @@
+import os
+import sys
+import datetime
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate_graph import SpxData
+from providers import SyntheticProvider
+
+START = datetime.datetime(year=2015, month=3, day=2)
+END = datetime.datetime(year=2019, month=7, day=1)
+
+
+def reference_increase(spx):
+    """Original iterrows/apply implementation of SpxData.prepare_graph"""
+    df = spx.df.copy()
+    yearly_returns = {}
+    last_close = spx.get_last_close(df.index[0].year)
+
+    for ind, row in df.iterrows():
+        # get closing value of last year
+        if ind.year not in yearly_returns:
+            yearly_returns[ind.year] = {"original": last_close}
+        last_close = row["Adj Close"]
+
+    return df.apply(
+        lambda row: spx.perc_increase(
+            yearly_returns[row.name.year]["original"], row["Adj Close"]
+        ),
+        axis=1,
+    ).to_numpy()
+
+
+def make_spx(nan_dates=()):
+    """SpxData over a few years of synthetic prices, with NaN closes on the given dates"""
+    provider = SyntheticProvider(seed=3)
+    margin = SpxData.margin_start(START)
+    prices = provider.get_prices(SpxData.symbol, margin, END)
+    closes = prices["Adj Close"].copy()
+    for date in nan_dates:
+        closes[date] = np.nan
+
+    df = closes[closes.index >= START].to_frame()
+    spx = SpxData(4, df=df, provider=provider)
+    spx.set_closes(closes, margin)
+    return spx
+
+
+def last_trading_day(spx, year):
+    return spx.df.index[spx.df.index.year == year][-1]
+
+
+def assert_same_increase(spx):
+    expected = reference_increase(spx)
+    spx.prepare_graph()
+    increase = spx.df["increase"].to_numpy()
+
+    assert increase.dtype == np.float32
+    np.testing.assert_array_equal(increase, expected.astype(np.float32))
+
+
+def test_increase_across_year_boundaries():
+    spx = make_spx()
+    assert spx.df.index[0].year < spx.df.index[-1].year
+
+    assert_same_increase(spx)
+
+
+def test_increase_with_nan_close():
+    spx = make_spx()
+    date = spx.df.index[spx.df.index.year == 2017][40]
+    spx = make_spx(nan_dates=[date])
+
+    assert_same_increase(spx)
+    assert np.isnan(spx.df.loc[date, "increase"])
+
+
+def test_increase_with_nan_close_at_year_end():
+    spx = make_spx()
+    date = last_trading_day(spx, 2016)
+    spx = make_spx(nan_dates=[date])
+
+    assert_same_increase(spx)
+    # NaN close is the base of the whole next year
+    assert spx.df.loc[spx.df.index.year == 2017, "increase"].isna().all()
+
+
+@pytest.mark.parametrize("year", [2016, 2018])
+def test_increase_from_row(year):
+    spx = make_spx()
+    spx.prepare_graph()
+    expected = spx.df["increase"].to_numpy().copy()
+
+    rows = int(np.flatnonzero(spx.df.index.year == year)[0])
+    spx.df.iloc[rows:, spx.df.columns.get_loc("increase")] = 0
+    spx.prepare_graph(rows)
+
+    np.testing.assert_array_equal(spx.df["increase"].to_numpy(), expected)
@@ -0,0 +1,91 @@
+import os
+import sys
+import datetime
+
+import pandas as pd
+import pytest
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate_graph
+import market_calendar
+from generate_graph import SpxWindows
+from providers import SyntheticProvider
+
+WINDOWS = [2, 5]
+# not a symbol with a backup price store in logs/
+SYMBOL = "TEST"
+
+
+@pytest.fixture
+def today(monkeypatch):
+    """Sets the current date, the time is in the evening after the close"""
+    state = {}
+
+    def set_today(day):
+        state["now"] = pytz.timezone("US/Eastern").localize(
+            datetime.datetime.combine(day, datetime.time(18))
+        )
+
+    monkeypatch.setattr(
+        generate_graph,
+        "last_completed_session",
+        lambda now=None: market_calendar.last_completed_session(now or state["now"]),
+    )
+    monkeypatch.setattr(generate_graph, "time_eastern", lambda raw=False: state["now"])
+    return set_today
+
+
+def assert_same_engine(engine, fresh):
+    pd.testing.assert_frame_equal(engine.history.df, fresh.history.df, check_freq=False)
+    pd.testing.assert_series_equal(
+        engine.history.closes, fresh.history.closes, check_freq=False
+    )
+    assert engine.aggregates.max_years == fresh.aggregates.max_years
+
+    figs, monthly_data, daily_data = engine.get_results()
+    fresh_figs, fresh_monthly, fresh_daily = fresh.get_results()
+    assert figs == fresh_figs
+    for years in monthly_data:
+        pd.testing.assert_frame_equal(monthly_data[years], fresh_monthly[years])
+        pd.testing.assert_frame_equal(daily_data[years], fresh_daily[years])
+    assert engine.aggregates.scan(2).equals(fresh.aggregates.scan(2))
+
+
+@pytest.mark.parametrize(
+    "first, steps",
+    [
+        # across the year end, the window start moves from December to January
+        (datetime.date(2023, 12, 20), [1, 1, 3, 1, 6, 1, 7, 13, 1, 30, 1]),
+        # across month ends, the last session on Feb 28 of a leap year
+        (datetime.date(2024, 2, 26), [1, 1, 3, 1, 27, 1, 31]),
+    ],
+)
+def test_update_matches_fresh_engine(today, first, steps):
+    provider = SyntheticProvider(seed=5)
+    day = first
+    today(day)
+    engine = SpxWindows(WINDOWS, provider, SYMBOL)
+
+    for step in steps:
+        day += datetime.timedelta(days=step)
+        today(day)
+        engine.update()
+
+        fresh = SpxWindows(WINDOWS, provider, SYMBOL)
+        assert_same_engine(engine, fresh)
+
+
+def test_update_without_new_bars(today):
+    provider = SyntheticProvider(seed=5)
+    today(datetime.date(2024, 3, 1))
+    engine = SpxWindows(WINDOWS, provider, SYMBOL)
+    rows = len(engine.history.df)
+
+    # Saturday, no new session
+    today(datetime.date(2024, 3, 2))
+    engine.update()
+
+    assert len(engine.history.df) == rows
+    assert_same_engine(engine, SpxWindows(WINDOWS, provider, SYMBOL))